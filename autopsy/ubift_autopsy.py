@@ -1,12 +1,23 @@
 import jarray
-import inspect
+import json
 import os
 import shutil
-from subprocess import Popen, PIPE
+import sys
 
 from java.lang import System
+from java.lang import ProcessBuilder
+from java.lang import Runtime
+from java.util.concurrent import Callable
+from java.util.concurrent import Executors
+from java.util.concurrent import ExecutorCompletionService
+from java.util.concurrent import ExecutionException
+from java.util.concurrent import TimeUnit
+from java.nio.file import Files
+from java.nio.file import Paths
+from java.nio.file.attribute import BasicFileAttributes
 from java.util.logging import Level
 from java.io import File
+from java.io import IOException
 from java.util import UUID
 from org.sleuthkit.autopsy.coreutils import PlatformUtil
 from org.sleuthkit.datamodel import SleuthkitCase
@@ -16,6 +27,7 @@ from org.sleuthkit.datamodel import ReadContentInputStream
 from org.sleuthkit.datamodel import BlackboardArtifact
 from org.sleuthkit.datamodel import BlackboardAttribute
 from org.sleuthkit.datamodel.TskData import TSK_DB_FILES_TYPE_ENUM
+from org.sleuthkit.datamodel.TskData import EncodingType
 from org.sleuthkit.autopsy.ingest import IngestModule
 from org.sleuthkit.autopsy.ingest.IngestModule import IngestModuleException
 from org.sleuthkit.autopsy.ingest import DataSourceIngestModule
@@ -33,6 +45,7 @@ from org.sleuthkit.autopsy.datamodel import ContentUtils
 from org.sleuthkit.autopsy.casemodule.services import Blackboard
 from org.sleuthkit.datamodel import Score
 from java.util import Arrays
+from java.util import ArrayList
 
 from javax.swing import JCheckBox
 from javax.swing import JList
@@ -94,11 +107,13 @@ class UBIFSDataSourceIngestModule(DataSourceIngestModule):
     _logger = Logger.getLogger(UBIFSDataSourceIngestModuleFactory.moduleName)
 
     def log(self, level, msg):
-        self._logger.logp(level, self.__class__.__name__, inspect.stack()[1][3], msg)
+        self._logger.logp(level, self.__class__.__name__, sys._getframe(1).f_code.co_name, msg)
 
     def __init__(self, settings):
         self.context = None
         self.local_settings = settings
+        self.ubift_path = None
+        self.ubift_path_str = None
 
     # Where any setup and configuration is done
     # 'context' is an instance of org.sleuthkit.autopsy.ingest.IngestJobContext.
@@ -112,14 +127,18 @@ class UBIFSDataSourceIngestModule(DataSourceIngestModule):
         # Get path to EXE based on where this script is run from.
         # Assumes EXE is in same folder as script
         # Verify it is there before any ingest starts
+        # The resolved path is also kept as a string, since it is needed for every invocation of UBIFT
+        module_dir = os.path.dirname(os.path.abspath(__file__))
         if PlatformUtil.isWindowsOS():
-            exe_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ubift.exe")
+            exe_path = os.path.join(module_dir, "ubift.exe")
             self.ubift_path = File(exe_path)
+            self.ubift_path_str = exe_path
             if not self.ubift_path.exists():
                 raise IngestModuleException("ubift Windows executable was not found in module folder")
         elif PlatformUtil.getOSName() == 'Linux':
-            exe_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ubift")
+            exe_path = os.path.join(module_dir, "ubift")
             self.ubift_path = File(exe_path)
+            self.ubift_path_str = exe_path
             if not self.ubift_path.exists():
                 raise IngestModuleException("ubift Linux executable was not found in module folder")
 
@@ -141,58 +160,212 @@ class UBIFSDataSourceIngestModule(DataSourceIngestModule):
         self.log(Level.INFO, "oob size: " + oobSize)
         
         progressBar.switchToIndeterminate()
-        fileManager = Case.getCurrentCase().getServices().getFileManager()
-        files = fileManager.findFiles(dataSource, '%%')
-        
+        tsk_case = Case.getCurrentCase().getSleuthkitCase()
+
+        # Nothing to do if the data source has no unallocated space, e.g., for logical file sets
+        if tsk_case.countFilesWhere(self.unalloc_blocks_query(dataSource)) == 0:
+            self.log(Level.INFO, "Datasource " + str(dataSource.getId()) + " has no unallocated blocks.")
+            return IngestModule.ProcessResult.OK
+
         # Create a temporary folder named AUTOPSY_UBI_{datasource id}
         temp_dir = Case.getCurrentCase().getTempDirectory()
         working_folder = os.path.join(temp_dir, "AUTOPSY_UBI_" + str(dataSource.getId()))
-        self.log(Level.INFO, "Writing UBIFT temporary files to: " + working_folder)
-        if os.path.exists(working_folder):
-            self.postMessage("This module should only be run once. There is already a temporary folder for datasource" + str(dataSource.getId()))
-            return IngestModule.ProcessResult.OK
-        else:
-            os.mkdir(working_folder)    
-        self.log(Level.INFO, "Writing UBIFT temporary files to: " + working_folder)
-        
-        for file in files:          
-            # Only process files of type UNALLOC_BLOCKS
-            if file.getType() is not TSK_DB_FILES_TYPE_ENUM.UNALLOC_BLOCKS:
-                continue
+        manifest_path = os.path.join(working_folder, "manifest.json")
 
-            # Check if the user pressed cancel while Autopsy was busy
-            if self.context.isJobCancelled():
+        # The manifest describes the UBIFT run that produced the content of the working folder. If a previous run
+        # used the same data source, UBIFT executable and settings, its recovered files can be reused.
+        manifest = {"dataSource": dataSource.getId(),
+                    "moduleVersion": UBIFSDataSourceIngestModuleFactory().getModuleVersionNumber(),
+                    "ubift": self.ubift_path.lastModified(),
+                    "settings": [eraseblockSize, pageSize, oobSize]}
+        previous_manifest = self.read_manifest(manifest_path)
+        if previous_manifest is not None and all(previous_manifest.get(k) == v for k, v in manifest.items()):
+            if previous_manifest.get("added", False):
+                self.postMessage("This module should only be run once. There is already a temporary folder for datasource" + str(dataSource.getId()))
                 return IngestModule.ProcessResult.OK
+            self.log(Level.INFO, "Resuming from UBIFT temporary files of a previous run in: " + working_folder)
+            manifest["recoveredFolders"] = previous_manifest.get("recoveredFolders", [])
+            manifest["addedFolders"] = previous_manifest.get("addedFolders", [])
+        else:
+            # Leftovers of a run with different settings are discarded
+            shutil.rmtree(working_folder, ignore_errors=True)
+            try:
+                os.makedirs(working_folder)
+            except OSError as e:
+                self.postMessage("Cannot create temporary folder for datasource " + str(dataSource.getId()) + ": " + str(e))
+                return IngestModule.ProcessResult.OK
+            self.log(Level.INFO, "Writing UBIFT temporary files to: " + working_folder)
+            manifest["recoveredFolders"] = []
+            manifest["addedFolders"] = []
+
+        # recover_files returns False if the job was cancelled
+        if not self.recover_files(dataSource, tsk_case, working_folder, eraseblockSize, pageSize, oobSize, manifest, manifest_path):
+            return IngestModule.ProcessResult.OK
 
-            # Since the File we want to process is a LayoutFile(virtual file), write it to the temporary
-            # folder so it can be passed to UBIFT via command line
-            temp_file_path = os.path.join(temp_dir, "UBI_" + str(dataSource.getId()))
-            ContentUtils.writeToFile(files[0], File(temp_file_path))   
-                
-            # Invoke UBIFT with command 'ubift_recover'
-            pipe = Popen([self.ubift_path.toString(), "ubift_recover", str(temp_file_path), "--verbose", "--blocksize", eraseblockSize, "--pagesize", pageSize, "--oob", oobSize, "--deleted", "--output", working_folder], stdout=PIPE, stderr=PIPE)
-            ubift_stdout, ubift_stderr = pipe.communicate()
-            
-            self.create_report(dataSource, ubift_stdout + ubift_stderr)
-            
-            # Create one folder for every UBIFS instance in the dataSource
-            for f in os.listdir(working_folder):
-                path = os.path.join(working_folder, f)
-                if os.path.isdir(path): 
-                    virtualRootDir = Case.getCurrentCase().getSleuthkitCase().addLocalDirectory(dataSource.getId(), str(f))
-                    self.add_dir_to_datasource(path, virtualRootDir)
+        manifest["added"] = True
+        self.write_manifest(manifest_path, manifest)
                  
         Case.getCurrentCase().notifyDataSourceAdded(dataSource, UUID.randomUUID())
         
         return IngestModule.ProcessResult.OK
+
+    # Runs UBIFT for all UNALLOC_BLOCKS files of a data source and adds its reports and recovered files to the case.
+    # Output folders already listed in the manifest are not recovered (or added) again.
+    # Returns False if the user pressed cancel, True otherwise.
+    def recover_files(self, dataSource, tsk_case, working_folder, eraseblockSize, pageSize, oobSize, manifest, manifest_path):
+        files = tsk_case.findAllFilesWhere(self.unalloc_blocks_query(dataSource))
+
+        # Every UNALLOC_BLOCKS file is independent of the others, so UBIFT is run for all of them concurrently.
+        # Every content gets its own output folder and report, see below.
+        tasks = []
+        # Output folders of this run, files with identical content share theirs
+        scheduled_folders = set()
+        for file in files:
+            # Files with identical content (size and MD5 hash) are recovered to the same output folder, so UBIFT only
+            # runs once for them and its output is added once. Whether that run completed is recorded in the manifest.
+            # The MD5 hash is only known if a hash module already ran, otherwise every file gets its own folder.
+            md5 = file.getMd5Hash()
+            task_id = str(dataSource.getId()) + "_" + (str(file.getSize()) + "_" + md5 if md5 else str(file.getId()))
+            output_folder = os.path.join(working_folder, "UBI_" + task_id)
+            report_path = os.path.join(Case.getCurrentCase().getCaseDirectory(), "Reports", "UBIFS_Report_" + task_id + ".txt")
+            if output_folder in scheduled_folders:
+                self.log(Level.INFO, "File " + str(file.getId()) + " has the same content as a previous file, its files are recovered to: " + output_folder)
+                continue
+            scheduled_folders.add(output_folder)
+            if output_folder in manifest["addedFolders"]:
+                continue
+            if output_folder in manifest["recoveredFolders"]:
+                self.add_output_folder(dataSource, tsk_case, output_folder, manifest, manifest_path)
+                continue
+            # Output of a UBIFT run that did not finish
+            shutil.rmtree(output_folder, ignore_errors=True)
+            os.mkdir(output_folder)
+            tasks.append(UBIFTTask(self, file, output_folder, report_path, eraseblockSize, pageSize, oobSize))
+
+        if not tasks:
+            return True
+
+        # The output of every UBIFT run is added to the case as soon as the run finished, while the remaining runs
+        # keep going. The Sleuthkit case is only ever accessed from this thread.
+        executor = Executors.newFixedThreadPool(Runtime.getRuntime().availableProcessors())
+        try:
+            completion_service = ExecutorCompletionService(executor)
+            # Maps the Future of every run to its task, so that a failed run can be reported for its file
+            pending = {}
+            for task in tasks:
+                pending[completion_service.submit(task)] = task
+
+            while pending:
+                # Waits for the next finished run, but checks every second if the user pressed cancel in the meantime
+                future = completion_service.poll(1, TimeUnit.SECONDS)
+                if self.context.isJobCancelled():
+                    return False
+                if future is None:
+                    continue
+                task = pending.pop(future)
+
+                # A failed run only concerns its own file, the remaining runs keep going. Its output folder is not
+                # recorded in the manifest, so the file is recovered again by the next ingest.
+                try:
+                    future.get()
+                except ExecutionException as e:
+                    self.log(Level.SEVERE, "UBIFT failed for file " + str(task.file.getId()) + ": " + str(e.getCause()))
+                    self.postMessage("UBIFT failed for file " + task.file.getName() + " (" + str(task.file.getId()) + "): " + str(e.getCause()))
+                    continue
+
+                self.create_report(task.report_path)
+                manifest["recoveredFolders"].append(task.output_folder)
+                self.write_manifest(manifest_path, manifest)
+                self.add_output_folder(dataSource, tsk_case, task.output_folder, manifest, manifest_path)
+        finally:
+            if self.context.isJobCancelled():
+                # Interrupts the runs that are still going, which kills their UBIFT processes (see run_ubift)
+                executor.shutdownNow()
+            else:
+                executor.shutdown()
+
+        return True
+
+    # Adds the UBIFS instances recovered to an output folder to the case, one folder for every UBIFS instance.
+    # This is done within a single transaction instead of committing every single file. Once committed, the output
+    # folder is recorded in the manifest, so that it is not added twice.
+    def add_output_folder(self, dataSource, tsk_case, output_folder, manifest, manifest_path):
+        trans = tsk_case.beginTransaction()
+        try:
+            for f, path, attrs in self.scandir(output_folder):
+                if attrs.isDirectory():
+                    virtualRootDir = tsk_case.addLocalDirectory(dataSource.getId(), f, trans)
+                    self.add_dir_to_datasource(path, virtualRootDir, trans)
+            trans.commit()
+        except:
+            trans.rollback()
+            raise
+
+        manifest["addedFolders"].append(output_folder)
+        self.write_manifest(manifest_path, manifest)
+
+    # Returns the WHERE clause that selects all files of type UNALLOC_BLOCKS of a data source.
+    # Only those files are processed, so the database does the filtering.
+    def unalloc_blocks_query(self, dataSource):
+        return "data_source_obj_id = " + str(dataSource.getId()) + " AND type = " + str(TSK_DB_FILES_TYPE_ENUM.UNALLOC_BLOCKS.getFileType())
+
+    # Reads the manifest of a previous run, returns None if there is none
+    def read_manifest(self, manifest_path):
+        if not os.path.isfile(manifest_path):
+            return None
+        try:
+            with open(manifest_path, 'r') as manifest_file:
+                return json.load(manifest_file)
+        except ValueError:
+            return None
+
+    # Writes the manifest of the current run, see process()
+    def write_manifest(self, manifest_path, manifest):
+        with open(manifest_path, 'w') as manifest_file:
+            json.dump(manifest, manifest_file)
     
-    # Creates a report based on a given string. For this module, the output of UBIFT is used as content for the report.
-    def create_report(self, dataSource, report_content):
-        report_path = os.path.join(Case.getCurrentCase().getCaseDirectory(), "Reports", "UBIFS_Report_" + str(dataSource.getId()) + ".txt")
-        report = open(report_path, 'wb+')
-        report.write(report_content)
-        report.close()
-        
+    # Recovers the files of a single UNALLOC_BLOCKS file with UBIFT command 'ubift_recover'.
+    # This is called concurrently for all files (see UBIFTTask). The output of UBIFT is written to 'report_path'.
+    def run_ubift(self, file, output_folder, report_path, eraseblockSize, pageSize, oobSize):
+        # Check if the user pressed cancel while Autopsy was busy
+        if self.context.isJobCancelled():
+            return
+
+        # Invoke UBIFT with command 'ubift_recover', it reads the image from stdin ('-')
+        # Its output is redirected straight into the report file instead of being buffered in memory
+        command = ArrayList()
+        for arg in [self.ubift_path_str, "ubift_recover", "-", "--verbose", "--blocksize", eraseblockSize, "--pagesize", pageSize, "--oob", oobSize, "--deleted", "--output", output_folder]:
+            command.add(arg)
+        process = ProcessBuilder(command).redirectErrorStream(True).redirectOutput(File(report_path)).start()
+        try:
+            # Since the File we want to process is a LayoutFile(virtual file), stream its content to UBIFT
+            # instead of writing it to a temporary file first
+            in_stream = ReadContentInputStream(file)
+            out_stream = process.getOutputStream()
+            buf = jarray.zeros(1 << 20, 'b')
+            try:
+                read = in_stream.read(buf)
+                while read != -1 and not self.context.isJobCancelled():
+                    out_stream.write(buf, 0, read)
+                    read = in_stream.read(buf)
+            except IOException as e:
+                # UBIFT stopped reading, e.g., because it exited early. Its output can be found in the report.
+                self.log(Level.WARNING, "UBIFT stopped reading the image of file " + str(file.getId()) + ": " + str(e))
+            finally:
+                in_stream.close()
+                out_stream.close()
+
+            # Waits for UBIFT to finish, but stops waiting as soon as the user pressed cancel
+            while not process.waitFor(1, TimeUnit.SECONDS):
+                if self.context.isJobCancelled():
+                    break
+        finally:
+            # Kills UBIFT if the user pressed cancel or this thread got interrupted (see recover_files)
+            if process.isAlive():
+                process.destroy()
+
+    # Adds a report to the case. For this module, the output of UBIFT is used as content for the report.
+    def create_report(self, report_path):
         Case.getCurrentCase().addReport(report_path, UBIFSDataSourceIngestModuleFactory.moduleName, "UBIFT Recovery Report")
         
     
@@ -201,24 +374,62 @@ class UBIFSDataSourceIngestModule(DataSourceIngestModule):
         msg = IngestMessage.createMessage(IngestMessage.MessageType.DATA,   UBIFSDataSourceIngestModuleFactory.moduleName, message)
         IngestServices.getInstance().postMessage(msg)
     
-    # Adds a directory and all of its content to a parent datasource
-    def add_dir_to_datasource(self, ubift_output_path, parent):
+    # Lists a directory and yields (name, path, attributes) for each of its entries, where attributes are the
+    # BasicFileAttributes of the entry. Jython has no os.scandir, so all attributes are read at once via java.nio instead.
+    def scandir(self, path):
+        stream = Files.newDirectoryStream(Paths.get(path))
+        try:
+            for entry in stream:
+                yield entry.getFileName().toString(), entry.toString(), Files.readAttributes(entry, BasicFileAttributes)
+        finally:
+            stream.close()
+
+    # Adds a directory and all of its content to a parent datasource using the given CaseDbTransaction.
+    # The directory tree is walked iteratively: directories are added as soon as they are found, since they are needed
+    # as parents, all files are collected and added in one go afterwards.
+    def add_dir_to_datasource(self, ubift_output_path, parent, trans):
         tsk_case = Case.getCurrentCase().getSleuthkitCase()
-        for f in os.listdir(ubift_output_path):
-            file_path = os.path.join(ubift_output_path, f)
-            if os.path.isfile(file_path):
-                # fileName, localPath, size, ctime, crtime, atime, mtime, isFile, parent
-                tsk_case.addLocalFile(f, file_path, os.path.getsize(file_path), long(os.path.getctime(file_path)), long(os.path.getctime(file_path)), long(os.path.getatime(file_path)), long(os.path.getmtime(file_path)), True, parent)
-            if os.path.isdir(file_path):
-                new_dir = tsk_case.addLocalFile(f, file_path, os.path.getsize(file_path), long(os.path.getctime(file_path)), long(os.path.getctime(file_path)), long(os.path.getatime(file_path)),long(os.path.getmtime(file_path)), False, parent)
-                self.add_dir_to_datasource(file_path, new_dir)
+        pending_files = []
+        stack = [(ubift_output_path, parent)]
+        while stack:
+            dir_path, dir_parent = stack.pop()
+            for f, file_path, attrs in self.scandir(dir_path):
+                ctime = attrs.creationTime().to(TimeUnit.SECONDS)
+                atime = attrs.lastAccessTime().to(TimeUnit.SECONDS)
+                mtime = attrs.lastModifiedTime().to(TimeUnit.SECONDS)
+                if attrs.isRegularFile():
+                    pending_files.append((f, file_path, attrs.size(), ctime, atime, mtime, dir_parent))
+                elif attrs.isDirectory():
+                    new_dir = tsk_case.addLocalFile(f, file_path, attrs.size(), ctime, ctime, atime, mtime, False, EncodingType.NONE, dir_parent, trans)
+                    stack.append((file_path, new_dir))
+
+        for f, file_path, size, ctime, atime, mtime, file_parent in pending_files:
+            # fileName, localPath, size, ctime, crtime, atime, mtime, isFile, encodingType, parent, transaction
+            tsk_case.addLocalFile(f, file_path, size, ctime, ctime, atime, mtime, True, EncodingType.NONE, file_parent, trans)
         
         
+# Runs UBIFT for a single UNALLOC_BLOCKS file, so that multiple files can be processed by an ExecutorService.
+# The results are only written to disk since the Sleuthkit case is updated from a single thread, see recover_files().
+class UBIFTTask(Callable):
+
+    def __init__(self, module, file, output_folder, report_path, eraseblockSize, pageSize, oobSize):
+        self.module = module
+        self.file = file
+        self.output_folder = output_folder
+        self.report_path = report_path
+        self.settings = (eraseblockSize, pageSize, oobSize)
+
+    def call(self):
+        eraseblockSize, pageSize, oobSize = self.settings
+        self.module.run_ubift(self.file, self.output_folder, self.report_path, eraseblockSize, pageSize, oobSize)
+        return self
+
+
 class UBIFSFileRecoverySettingsPanel(IngestModuleIngestJobSettingsPanel):
     _logger = Logger.getLogger(UBIFSDataSourceIngestModuleFactory.moduleName)
 
     def log(self, level, msg):
-        self._logger.logp(level, self.__class__.__name__, inspect.stack()[1][3], msg)
+        self._logger.logp(level, self.__class__.__name__, sys._getframe(1).f_code.co_name, msg)
     
     
     def __init__(self, settings):
@@ -0,0 +1,172 @@
+import io
+import logging
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+from ubift import exception
+from ubift.cli import CommandLine, VERBOSE_LOG_LEVEL, rootlog
+
+
+@pytest.fixture
+def cli(monkeypatch):
+    """
+    CommandLine whose commands are parsed as usual, but only record their arguments and the level of the root logger
+    instead of running.
+    """
+    cli = CommandLine()
+    cli.calls = []
+    commands = CommandLine._commands(cli)
+
+    def record(name):
+        def run(args):
+            CommandLine.verbose(args)
+            cli.calls.append((name, args, rootlog.level))
+            if args.input == "fails.bin":
+                raise exception.UBIFTException("Cannot open fails.bin")
+        return run
+
+    monkeypatch.setattr(cli, "_commands", lambda: {name: (add, record(name)) for name, (add, _) in commands.items()})
+    level = rootlog.level
+    yield cli
+    rootlog.setLevel(level)
+
+
+def _batch(cli, tmp_path, lines):
+    commands = tmp_path / "commands.txt"
+    commands.write_text("\n".join(lines))
+    cli.batch(cli._create_parser(cli._commands(), "batch").parse_args(["batch", str(commands)]))
+
+
+def test_batch_parses_every_line(cli, tmp_path):
+    _batch(cli, tmp_path, [
+        "# Comments and empty lines are skipped",
+        "",
+        "mtdls dump.bin --blocksize 131072 --pagesize 2048",
+        "  icat 'my dump.bin' -o 0 -n data 42 --output out.bin  ",
+        "fls dump.bin -o 3 -i 1 --path --master 2",
+    ])
+    calls = cli.calls
+
+    assert [name for name, _, _ in calls] == ["mtdls", "icat", "fls"]
+    _, mtdls, _ = calls[0]
+    assert (mtdls.input, mtdls.blocksize, mtdls.pagesize, mtdls.oob) == ("dump.bin", 131072, 2048, None)
+    _, icat, _ = calls[1]
+    assert (icat.input, icat.offset, icat.volname, icat.inode, icat.output) == ("my dump.bin", 0, "data", 42, "out.bin")
+    _, fls, _ = calls[2]
+    assert (fls.offset, fls.volindex, fls.path, fls.master) == (3, 1, True, 2)
+
+
+def test_batch_sets_verbosity_per_line(cli, tmp_path):
+    _batch(cli, tmp_path, [
+        "mtdls dump.bin --verbose",
+        "mtdls dump.bin",
+        "ubils dump.bin -a --verbose",
+        "pebcat dump.bin 3",
+    ])
+    calls = cli.calls
+
+    assert [level for _, _, level in calls] == [VERBOSE_LOG_LEVEL, logging.ERROR, VERBOSE_LOG_LEVEL, logging.ERROR]
+
+
+def test_batch_continues_after_invalid_and_failing_lines(cli, tmp_path):
+    _batch(cli, tmp_path, [
+        "mtdls",
+        "nocommand dump.bin",
+        "batch commands.txt",
+        "mtdls fails.bin",
+        "mtdls dump.bin",
+    ])
+    calls = cli.calls
+
+    assert [(name, args.input) for name, args, _ in calls] == [("mtdls", "fails.bin"), ("mtdls", "dump.bin")]
+
+
+def test_batch_reads_commands_from_stdin(cli, monkeypatch):
+    monkeypatch.setattr(sys, "stdin", io.StringIO("mtdls dump.bin\npebcat dump.bin 1\n"))
+    cli.batch(cli._create_parser(cli._commands(), "batch").parse_args(["batch", "-"]))
+
+    assert [name for name, _, _ in cli.calls] == ["mtdls", "pebcat"]
+
+
+def test_batch_clears_leb_data_after_every_command(monkeypatch, tmp_path):
+    pytest.importorskip("cstruct")
+    pytest.importorskip("crcmod")
+    from ubift.framework.partitioner import UBIPartitioner
+
+    cli = CommandLine()
+    cleared = []
+
+    class FakeUBI:
+        volumes = []
+
+        def clear_leb_data(self):
+            cleared.append(self)
+
+    ubi = FakeUBI()
+    partitions = [SimpleNamespace(name="Unallocated", ubi_instance=None), SimpleNamespace(name="UBI", ubi_instance=ubi)]
+    monkeypatch.setattr(cli, "_open_mtd", lambda args: SimpleNamespace(partitions=[]))
+    monkeypatch.setattr(UBIPartitioner, "partition", lambda self, image, fill_partitions=True: partitions)
+    level = rootlog.level
+
+    recover = f"ubift_recover dump.bin --output '{tmp_path}'"
+    _batch(cli, tmp_path, [recover, "mtdls", recover])
+    rootlog.setLevel(level)
+
+    assert cleared == [ubi, ubi]
+
+
+def test_batch_recovers_volumes_in_process(monkeypatch, tmp_path):
+    cli = CommandLine()
+    recovered = []
+    volumes = [SimpleNamespace(name="data"), SimpleNamespace(name="rootfs")]
+    monkeypatch.setattr(cli, "_open_mtd", lambda args: SimpleNamespace())
+    monkeypatch.setattr(cli, "_initialize_ubi_instances", lambda image, do_partitioning: [SimpleNamespace(volumes=volumes)])
+    monkeypatch.setattr(cli, "_recover_ubi_volume",
+                        lambda ubi_vol, ubi_vol_dir, deleted: recovered.append((ubi_vol.name, os.getpid())))
+    level = rootlog.level
+
+    _batch(cli, tmp_path, [f"ubift_recover dump.bin --output '{tmp_path}'"])
+    rootlog.setLevel(level)
+
+    assert recovered == [("data", os.getpid()), ("rootfs", os.getpid())]
+
+
+def _mtd_args(path, **kwargs):
+    args = dict(input=str(path), oob=None, pagesize=None, blocksize=None, pebthreshold=3)
+    args.update(kwargs)
+    return SimpleNamespace(**args)
+
+
+def test_initialize_mtd_reads_empty_dump(tmp_path):
+    pytest.importorskip("cstruct")
+    pytest.importorskip("crcmod")
+    dump = tmp_path / "empty.bin"
+    dump.write_bytes(b"")
+
+    image = CommandLine()._initialize_mtd(_mtd_args(dump, pagesize=2048, blocksize=131072))
+    assert len(image.data) == 0
+
+    # Sizes cannot be guessed without UBI headers
+    with pytest.raises(exception.UBIFTException):
+        CommandLine()._initialize_mtd(_mtd_args(dump))
+
+
+def test_batch_continues_after_missing_and_empty_dumps(monkeypatch, tmp_path):
+    pytest.importorskip("cstruct")
+    pytest.importorskip("crcmod")
+    cli = CommandLine()
+    opened = []
+    open_mtd = cli._open_mtd
+    monkeypatch.setattr(cli, "_open_mtd", lambda args: opened.append(args.input) or open_mtd(args))
+    level = rootlog.level
+
+    (tmp_path / "empty.bin").write_bytes(b"")
+
+    _batch(cli, tmp_path, [f"mtdls '{tmp_path / 'missing.bin'}'", f"mtdls '{tmp_path / 'empty.bin'}'",
+                           f"mtdls '{tmp_path / 'missing2.bin'}'"])
+    rootlog.setLevel(level)
+
+    assert opened == [str(tmp_path / name) for name in ("missing.bin", "empty.bin", "missing2.bin")]
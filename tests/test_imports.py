@@ -0,0 +1,21 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+for module in ("cstruct", "crcmod", "lzo", "zstandard"):
+    pytest.importorskip(module)
+
+
+@pytest.mark.parametrize("module", [
+    "ubift.framework.compression",
+    "ubift.framework.structs.ubifs_structs",
+    "ubift.framework.ubi",
+    "ubift.framework.ubifs",
+    "ubift.framework.visitor",
+    "ubift.cli.renderer",
+])
+def test_framework_module_can_be_imported_first(module):
+    # The commands only import the modules they need, so every module has to be importable in a fresh interpreter
+    subprocess.run([sys.executable, "-c", f"import {module}"], check=True, cwd=os.path.dirname(os.path.dirname(__file__)))
@@ -0,0 +1,26 @@
+import pytest
+
+pytest.importorskip("cstruct")
+pytest.importorskip("crcmod")
+
+from ubift.framework.mtd import Image
+
+
+def _raw_dump(pages: int, page_size: int, oob_size: int) -> bytes:
+    # Every page is filled with its index, every OOB area with 0xFF
+    return b"".join(bytes([i % 0xFF]) * page_size + b"\xff" * oob_size for i in range(pages))
+
+
+@pytest.mark.parametrize("page_size,oob_size,pages_per_block", [
+    (16, 4, 4),
+    (2048, 64, 64),
+    (4096, 128, 64),
+])
+def test_strip_oob_uses_page_and_oob_size_as_stride(page_size, oob_size, pages_per_block):
+    pages = 2 * pages_per_block
+    data = _raw_dump(pages, page_size, oob_size)
+
+    stripped = Image.strip_oob(data, page_size * pages_per_block, page_size, oob_size)
+
+    assert len(stripped) == pages * page_size
+    assert stripped == b"".join(bytes([i % 0xFF]) * page_size for i in range(pages))
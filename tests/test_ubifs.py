@@ -0,0 +1,202 @@
+import random
+import struct
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("cstruct")
+pytest.importorskip("crcmod")
+pytest.importorskip("lzo")
+pytest.importorskip("zstandard")
+
+from ubift.framework import ubifs as ubifs_module
+from ubift.framework.structs.ubifs_structs import UBIFS_CH, UBIFS_IDX_NODE, UBIFS_KEY, UBIFS_KEY_TYPES
+from ubift.framework.ubifs import UBIFS
+
+# LEB that holds the (fake) leaf nodes, the offset of a leaf is its index in the sorted list of keys
+LEAF_LEB = 0
+
+
+def _idx_node(level: int, branches: list) -> bytes:
+    """
+    :param branches: List of (lnum, offs, UBIFS_KEY)
+    """
+    data = b"".join(struct.pack("<LLL", lnum, offs, 0) + key.pack() for lnum, offs, key in branches)
+    ch = struct.pack("<LLQLBB2x", 0x06101831, 0, 1, UBIFS_CH.size + 4 + len(data), 9, 0)
+    return ch + struct.pack("<HH", len(branches), level) + data
+
+
+def _build_tree(keys: list, fanout: int):
+    """
+    Builds a B-Tree of index nodes for sorted keys, every index node is written to its own LEB.
+    :return: UBIFS instance that only has its volume set and the root index node
+    """
+    lebs = {LEAF_LEB: SimpleNamespace(data=b"")}
+    # (lnum, offs, first key) of the nodes of the current level
+    level_nodes = [(LEAF_LEB, i, key) for i, key in enumerate(keys)]
+    level = 0
+    while True:
+        parents = []
+        for i in range(0, len(level_nodes), fanout):
+            children = level_nodes[i:i + fanout]
+            lnum = len(lebs)
+            lebs[lnum] = SimpleNamespace(data=_idx_node(level, children))
+            parents.append((lnum, 0, children[0][2]))
+        if len(parents) == 1:
+            break
+        level_nodes = parents
+        level += 1
+
+    ubifs = UBIFS.__new__(UBIFS)
+    ubifs._ubi_volume = SimpleNamespace(lebs=lebs)
+    ubifs._idx_nodes = {}
+    return ubifs, UBIFS_IDX_NODE(lebs[parents[0][0]].data, 0)
+
+
+@pytest.fixture(autouse=True)
+def leaf_nodes(monkeypatch):
+    # Leafs are not parsed, but identified by their offset
+    monkeypatch.setattr(ubifs_module, "parse_arbitrary_node", lambda data, offs: offs)
+
+
+def _linear_find(ubifs: UBIFS, node: UBIFS_IDX_NODE, key: UBIFS_KEY):
+    """
+    The linear scan _find used before its branches were searched with bisect.
+    """
+    branches = node.branches if isinstance(node.branches, list) else [node.branches]
+    sel_branch = None
+    for i, branch in enumerate(branches):
+        branch_key = branch.python_key()
+        if key < branch_key:
+            sel_branch = branch if i == 0 else branches[i - 1]
+            break
+        elif key == branch_key:
+            if node.level == 0:
+                return branch.offs
+            else:
+                sel_branch = branch
+    if node.level == 0:
+        return None
+    if sel_branch is None:
+        sel_branch = branches[-1]
+    return _linear_find(ubifs, ubifs._create_idx_node(sel_branch), key)
+
+
+def _linear_find_range(ubifs: UBIFS, node: UBIFS_IDX_NODE, min_key: UBIFS_KEY, max_key: UBIFS_KEY) -> list:
+    """
+    Scans all leafs of the B-Tree for keys within [min_key, max_key).
+    """
+    branches = node.branches if isinstance(node.branches, list) else [node.branches]
+    if node.level == 0:
+        return [branch.offs for branch in branches if min_key <= branch.python_key() < max_key]
+    result = []
+    for branch in branches:
+        result += _linear_find_range(ubifs, ubifs._create_idx_node(branch), min_key, max_key)
+    return result
+
+
+def _keys(seed: int) -> list:
+    """
+    Sorted keys of a few inodes, including directory entries whose hashes collide.
+    """
+    rnd = random.Random(seed)
+    keys = []
+    for inum in range(1, 40):
+        keys.append(UBIFS_KEY.create_key(inum, UBIFS_KEY_TYPES.UBIFS_INO_KEY, 0))
+        keys += [UBIFS_KEY.create_key(inum, UBIFS_KEY_TYPES.UBIFS_DATA_KEY, block) for block in range(rnd.randrange(4))]
+        keys += [UBIFS_KEY.create_key(inum, UBIFS_KEY_TYPES.UBIFS_DENT_KEY, rnd.randrange(8)) for _ in range(rnd.randrange(6))]
+    return sorted(keys)
+
+
+def _absent_keys(keys: list) -> list:
+    present = {key.as_int() for key in keys}
+    candidates = [UBIFS_KEY.create_key(0, UBIFS_KEY_TYPES.UBIFS_INO_KEY, 0),
+                  UBIFS_KEY.create_key(0xFFFFFFFF, UBIFS_KEY_TYPES.UBIFS_XENT_KEY, 0x1FFFFFFF)]
+    candidates += [UBIFS_KEY.create_key(key.inode_num, key.key_type, key.payload + 1) for key in keys]
+    return [key for key in candidates if key.as_int() not in present]
+
+
+@pytest.mark.parametrize("fanout", [2, 3, 4, 8])
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_find_matches_linear_scan(fanout, seed):
+    keys = _keys(seed)
+    ubifs, root = _build_tree(keys, fanout)
+
+    for key in keys + _absent_keys(keys):
+        assert ubifs._find(root, key) == _linear_find(ubifs, root, key)
+
+
+@pytest.mark.parametrize("fanout", [2, 3, 8])
+def test_find(fanout):
+    keys = _keys(seed=4)
+    ubifs, root = _build_tree(keys, fanout)
+
+    for i, key in enumerate(keys):
+        found = ubifs._find(root, key)
+        # Directory entries with colliding hashes share their key, so any of them may be found
+        assert keys[found] == key
+        if keys.count(key) == 1:
+            assert found == i
+    for key in _absent_keys(keys):
+        assert ubifs._find(root, key) is None
+
+
+def test_find_in_single_branch_node():
+    key = UBIFS_KEY.create_key(1, UBIFS_KEY_TYPES.UBIFS_INO_KEY, 0)
+    ubifs, root = _build_tree([key], fanout=4)
+
+    assert ubifs._find(root, key) == 0
+    assert ubifs._find(root, UBIFS_KEY.create_key(2, UBIFS_KEY_TYPES.UBIFS_INO_KEY, 0)) is None
+
+
+def _ranges(keys: list) -> list:
+    """
+    Ranges of all data nodes, directory entries and keys of every inode (as searched by the commands), and some
+    ranges between arbitrary keys.
+    """
+    ranges = []
+    for inum in range(0, 42):
+        for key_type in (UBIFS_KEY_TYPES.UBIFS_DATA_KEY, UBIFS_KEY_TYPES.UBIFS_DENT_KEY):
+            ranges.append((UBIFS_KEY.create_key(inum, key_type, 0), UBIFS_KEY.create_key(inum, key_type + 1, 0)))
+        ranges.append((UBIFS_KEY.create_key(inum, UBIFS_KEY_TYPES.UBIFS_INO_KEY, 0),
+                       UBIFS_KEY.create_key(inum + 1, UBIFS_KEY_TYPES.UBIFS_INO_KEY, 0)))
+    rnd = random.Random(len(keys))
+    for _ in range(50):
+        ranges.append(tuple(sorted(rnd.sample(keys, 2))))
+    return ranges
+
+
+@pytest.mark.parametrize("fanout", [2, 3, 4, 8])
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_find_range_matches_linear_scan(fanout, seed):
+    keys = _keys(seed)
+    ubifs, root = _build_tree(keys, fanout)
+
+    for min_key, max_key in _ranges(keys):
+        assert ubifs._find_range(root, min_key, max_key) == _linear_find_range(ubifs, root, min_key, max_key)
+
+
+@pytest.mark.parametrize("fanout", [2, 3, 4])
+def test_find_range_with_duplicated_min_key(fanout):
+    dent_key = UBIFS_KEY.create_key(1, UBIFS_KEY_TYPES.UBIFS_DENT_KEY, 5)
+    # The directory entries with colliding hashes are split across multiple index nodes
+    keys = [UBIFS_KEY.create_key(1, UBIFS_KEY_TYPES.UBIFS_INO_KEY, 0)] + [dent_key] * 6 + \
+           [UBIFS_KEY.create_key(2, UBIFS_KEY_TYPES.UBIFS_INO_KEY, 0)]
+    ubifs, root = _build_tree(keys, fanout)
+
+    assert ubifs._find_range(root, dent_key, UBIFS_KEY.create_key(1, UBIFS_KEY_TYPES.UBIFS_DENT_KEY, 6)) == \
+           [1, 2, 3, 4, 5, 6]
+
+
+def test_find_range_does_not_share_results_between_calls():
+    keys = _keys(seed=5)
+    ubifs, root = _build_tree(keys, fanout=3)
+    min_key = UBIFS_KEY.create_key(1, UBIFS_KEY_TYPES.UBIFS_INO_KEY, 0)
+    max_key = UBIFS_KEY.create_key(2, UBIFS_KEY_TYPES.UBIFS_INO_KEY, 0)
+
+    first = ubifs._find_range(root, min_key, max_key)
+    second = ubifs._find_range(root, min_key, max_key)
+
+    assert len(first) > 0
+    assert first == second
+    assert first is not second
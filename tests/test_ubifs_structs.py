@@ -0,0 +1,78 @@
+import random
+import struct
+
+import pytest
+
+pytest.importorskip("cstruct")
+pytest.importorskip("lzo")
+pytest.importorskip("zstandard")
+
+from ubift.framework.structs.ubi_structs import UBI_VTBL_RECORD
+from ubift.framework.structs.ubifs_structs import UBIFS_CH, UBIFS_DENT_NODE, UBIFS_IDX_NODE, UBIFS_KEY
+
+
+def _dent_node(name: bytes) -> bytes:
+    ch = struct.pack("<LLQLBB2x", 0x06101831, 0, 1, UBIFS_CH.size + 40 + len(name), 2, 0)
+    key = struct.pack("<LL8x", 1, (2 << 29) | 42)
+    return ch + key + struct.pack("<QBBHL", 65, 0, 1, len(name), 0) + name
+
+
+def _vtbl_record(name: bytes) -> bytes:
+    return struct.pack(">LLLBBH128sB23sL", 4, 1, 0, 1, 0, len(name), name, 0, b"", 0)
+
+
+@pytest.mark.parametrize("name", ["config", "file0", "a\tb", "grüße.txt"])
+def test_dent_formatted_name(name):
+    dent = UBIFS_DENT_NODE(_dent_node(name.encode()), 0)
+    assert dent.formatted_name() == name
+
+
+def test_dent_formatted_name_ignores_invalid_bytes():
+    dent = UBIFS_DENT_NODE(_dent_node(b"ab\xffc"), 0)
+    assert dent.formatted_name() == "abc"
+
+
+@pytest.mark.parametrize("name", ["rootfs", "data0", "\x01vol"])
+def test_volume_formatted_name_only_decodes_name_len_bytes(name):
+    record = UBI_VTBL_RECORD(_vtbl_record(name.encode()), 0)
+    assert record.formatted_name() == name
+
+
+def _random_keys(count: int, seed: int):
+    rnd = random.Random(seed)
+    keys = [UBIFS_KEY.create_key(rnd.choice([0, 1, 2, 0xFFFFFFFF, rnd.randrange(1 << 32)]),
+                                 rnd.randrange(8),
+                                 rnd.choice([0, 1, 0x1FFFFFFF, rnd.randrange(1 << 29)]))
+            for _ in range(count)]
+    return keys + keys[:count // 4]
+
+
+def test_key_as_int_has_the_same_order_as_keys():
+    keys = _random_keys(200, seed=1)
+    for a in keys:
+        for b in keys:
+            assert (a < b) == (a.as_int() < b.as_int())
+            assert (a == b) == (a.as_int() == b.as_int())
+    assert [key.as_int() for key in sorted(keys)] == sorted(key.as_int() for key in keys)
+
+
+def test_key_as_int_matches_the_raw_key():
+    for key in _random_keys(50, seed=2):
+        assert UBIFS_KEY(key.pack()).as_int() == key.as_int()
+        assert key.matches(list(key.pack()) + [0] * 8)
+
+
+def test_branch_keys_are_the_keys_of_the_branches():
+    keys = sorted(_random_keys(10, seed=3))
+    branches = b"".join(struct.pack("<LLL", i, 0, 0) + key.pack() for i, key in enumerate(keys))
+    ch = struct.pack("<LLQLBB2x", 0x06101831, 0, 1, UBIFS_CH.size + 4 + len(branches), 9, 0)
+    idx_node = UBIFS_IDX_NODE(ch + struct.pack("<HH", len(keys), 0) + branches, 0)
+
+    assert idx_node.branch_keys() == [branch.python_key().as_int() for branch in idx_node.branches]
+    assert idx_node.branch_keys() == [key.as_int() for key in keys]
+
+
+@pytest.mark.parametrize("inum,key_type,payload", [(-1, 0, 0), (1 << 32, 0, 0), (1, 8, 0), (1, 0, 1 << 29), (1, 0, -1)])
+def test_create_key_rejects_out_of_range_fields(inum, key_type, payload):
+    with pytest.raises(struct.error):
+        UBIFS_KEY.create_key(inum, key_type, payload)
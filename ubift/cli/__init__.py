@@ -1,97 +1,160 @@
+from __future__ import annotations
+
 import argparse
-import errno
 import logging
+import mmap
 import os
+import signal
 import sys
-from typing import List
-import codecs
-
-from pathvalidate import sanitize_filepath
+from typing import List, Dict, Tuple, Callable, Iterable, TYPE_CHECKING
 
 from ubift import exception
-from ubift.cli.renderer import render_lebs, render_ubi_instances, render_image, render_dents, render_inode_node, \
-    render_data_nodes, render_inode_list, write_to_file, render_xents
-from ubift.framework import visitor
-from ubift.framework.mtd import Image
-from ubift.framework.partitioner import UBIPartitioner
-from ubift.framework.structs.ubifs_structs import UBIFS_KEY, UBIFS_KEY_TYPES, UBIFS_INODE_TYPES, UBIFS_DENT_NODE, UBIFS_INO_NODE
-from ubift.framework.ubi import UBI, UBIVolume
-from ubift.framework.ubifs import UBIFS
 from ubift.logging import ubiftlog
 
+# The framework is only imported by the commands that need it, so that parsing arguments (or -h) stays fast
+if TYPE_CHECKING:
+    from ubift.framework.mtd import Image, Partition
+    from ubift.framework.structs.ubifs_structs import UBIFS_DENT_NODE, UBIFS_INO_NODE
+    from ubift.framework.ubi import UBI, UBIVolume
+    from ubift.framework.ubifs import UBIFS
+
 rootlog = logging.getLogger()
 console = logging.StreamHandler()
 console.setLevel(logging.INFO)
 formatter = logging.Formatter("%(levelname)-4s %(name)-3s: %(message)s")
 console.setFormatter(formatter)
 
-rootlog.setLevel(1)
+# Level of the root logger if --verbose is set, see CommandLine.verbose
+VERBOSE_LOG_LEVEL = 1
+rootlog.setLevel(VERBOSE_LOG_LEVEL)
 rootlog.addHandler(console)
 
 
 class CommandLine:
 
     def __init__(self):
-        pass
+        # Initialized Images, see _open_mtd
+        self._images = {}
+        # Initialized UBI Volumes (and the Image and UBI instance they belong to), see _open_ubi_volume
+        self._ubi_volumes = {}
+        # Initialized UBIFS instances (including their cached traversals and scans), see _open_ubifs
+        self._ubifs = {}
+        # UBI instances returned by _get_ubi, whose cached LEB data is released after every command of 'batch'
+        self._ubi_instances = set()
+        # Set while commands are run by 'batch'
+        self._in_batch = False
 
     def run(self):
+        # Output is usually piped into other tools (e.g., head or xxd). If they exit early, the process terminates quietly
+        # like other command line tools instead of raising BrokenPipeError. SIGPIPE is not available on Windows.
+        if hasattr(signal, "SIGPIPE"):
+            signal.signal(signal.SIGPIPE, signal.SIG_DFL)
+
+        # Only the parser of the command that is run gets constructed. The top-level parser has no options except
+        # for -h, so the command is always the first argument.
+        commands = self._commands()
+        parser = self._create_parser(commands, sys.argv[1] if len(sys.argv) > 1 else None)
+
+        args = parser.parse_args()
+        commands[args.command][1](args)
+
+    @staticmethod
+    def _create_parser(commands: Dict[str, Tuple[Callable[[argparse._SubParsersAction], None], Callable[[argparse.Namespace], None]]],
+                       command: str = None) -> argparse.ArgumentParser:
+        """
+        Creates the argument parser for the given commands (see _commands).
+        :param commands: Commands that can be parsed
+        :param command: If set to one of the commands, only the parser of this command is added. Otherwise (e.g., -h)
+        all commands are added so argparse can list them.
+        :return: Argument parser
+        """
         parser = argparse.ArgumentParser()
         subparsers = parser.add_subparsers(dest="command", help="Commands to run", required=True)
 
-        # mtdls
+        if command in commands:
+            commands[command][0](subparsers)
+        else:
+            for add_command, _ in commands.values():
+                add_command(subparsers)
+
+        return parser
+
+    def _commands(self) -> Dict[str, Tuple[Callable[[argparse._SubParsersAction], None], Callable[[argparse.Namespace], None]]]:
+        """
+        Maps the name of every command to a function that adds the parser of that command to the subparsers and
+        the function that runs the command.
+        :return: Dict of command names to (add_parser, run) functions, in the order they will be listed by -h
+        """
+        return {
+            "mtdls": (self._add_mtdls, self.mtdls),
+            "mtdcat": (self._add_mtdcat, self.mtdcat),
+            "pebcat": (self._add_pebcat, self.pebcat),
+            "ubils": (self._add_ubils, self.ubils),
+            "lebls": (self._add_lebls, self.lebls),
+            "lebcat": (self._add_lebcat, self.lebcat),
+            "ubicat": (self._add_ubicat, self.ubicat),
+            "fsstat": (self._add_fsstat, self.fsstat),
+            "fls": (self._add_fls, self.fls),
+            "istat": (self._add_istat, self.istat),
+            "icat": (self._add_icat, self.icat),
+            "ils": (self._add_ils, self.ils),
+            "ffind": (self._add_ffind, self.ffind),
+            "jls": (self._add_jls, self.jls),
+            "ubift_recover": (self._add_ubift_recover, self.ubift_recover),
+            "ubift_info": (self._add_ubift_info, self.ubift_info),
+            "batch": (self._add_batch, self.batch),
+        }
+
+    def _add_mtdls(self, subparsers: argparse._SubParsersAction) -> None:
         mtdls = subparsers.add_parser("mtdls",
                                       help="Lists information about all available Partitions, including UBI instances. UBI instances have the description 'UBI'.")
         self.add_default_mtd_args(mtdls)
-        mtdls.set_defaults(func=self.mtdls)
 
-        # mtdcat
+    def _add_mtdcat(self, subparsers: argparse._SubParsersAction) -> None:
         mtdcat = subparsers.add_parser("mtdcat",
                                        help="Outputs the binary data of an MTD partition, given by its index. Use 'mtdls' to see all indeces.")
         self.add_default_mtd_args(mtdcat)
         mtdcat.add_argument("index", type=int)
-        mtdcat.set_defaults(func=self.mtdcat)
 
-        # pebcat
+    def _add_pebcat(self, subparsers: argparse._SubParsersAction) -> None:
         pebcat = subparsers.add_parser("pebcat", help="Outputs a specific phyiscal erase block.")
         self.add_default_mtd_args(pebcat)
         pebcat.add_argument("index", type=int)
-        pebcat.set_defaults(func=self.pebcat)
 
-        # ubils
+    def _add_ubils(self, subparsers: argparse._SubParsersAction) -> None:
         ubils = subparsers.add_parser("ubils", help="Lists all instances of UBI and their volumes.")
         self.add_default_mtd_args(ubils)
         self.add_default_ubi_args(ubils, ubils=True)
-        ubils.set_defaults(func=self.ubils)
 
-        # lebls
+    def _add_lebls(self, subparsers: argparse._SubParsersAction) -> None:
         lebls = subparsers.add_parser("lebls", help="Lists all mapped LEBs of a specific UBI volume.")
         self.add_default_mtd_args(lebls)
-        lebls.set_defaults(func=self.lebls)
+        self.add_default_ubi_args(lebls)
 
-        # lebcat
+    def _add_lebcat(self, subparsers: argparse._SubParsersAction) -> None:
         lebcat = subparsers.add_parser("lebcat",
                                        help="Outputs a specific mapped logical erase block of a specified UBI volume.")
         self.add_default_mtd_args(lebcat)
         lebcat.add_argument("lebnumber", help="Number of the logical erase block. Use 'lebls' to determine LEBs.", type=int)
         lebcat.add_argument("--headers", help="If set, will also output headers instead of just data of the LEB.", default=False,
                          action="store_true")
-        lebcat.set_defaults(func=self.lebcat)
+        self.add_default_ubi_args(lebcat)
 
-        # ubicat
+    def _add_ubicat(self, subparsers: argparse._SubParsersAction) -> None:
         ubicat = subparsers.add_parser("ubicat", help="Outputs a specific UBI volume.")
         ubicat.add_argument("--headers", help="If set, output will include UBI headers instead of just data of the LEB.",
                             default=False,
                             action="store_true")
         self.add_default_mtd_args(ubicat)
-        ubicat.set_defaults(func=self.ubicat)
+        self.add_default_ubi_args(ubicat)
 
-        # fsstat
+    def _add_fsstat(self, subparsers: argparse._SubParsersAction) -> None:
         fsstat = subparsers.add_parser("fsstat",
                                        help="Outputs information regarding the UBIFS file-system within a specific UBI volume.")
         self.add_default_mtd_args(fsstat)
-        fsstat.set_defaults(func=self.fsstat)
+        self.add_default_ubi_args(fsstat)
 
-        # fls
+    def _add_fls(self, subparsers: argparse._SubParsersAction) -> None:
         fls = subparsers.add_parser("fls",
                                     help="Outputs information regarding file names in an UBIFS instance within a specific UBI volume.")
         self.add_default_mtd_args(fls)
@@ -104,28 +167,30 @@ class CommandLine:
         fls.add_argument("--deleted", "-d",
                          help="Similar to scan. Will perform scanning for signatures instead of using the file index. Will only show deleted directory entries. This will take priority over --scan.",
                          default=False, action="store_true")
-        fls.set_defaults(func=self.fls)
+        self.add_default_ubi_args(fls)
+        self.add_default_ubifs_args(fls)
 
-        # istat
+    def _add_istat(self, subparsers: argparse._SubParsersAction) -> None:
         istat = subparsers.add_parser("istat", help="Displays information about a specific inode in an UBIFS instance.")
         self.add_default_mtd_args(istat)
         istat.add_argument("--scan", "-s",
                            help="If set, will perform scanning for inodes instead of traversing the file-index. Thus allowing to use istat on inodes that are no longer part of the file index.",
                            default=False, action="store_true")
         istat.add_argument("inode", help="Inode number.", type=int)
-        istat.set_defaults(func=self.istat)
+        self.add_default_ubi_args(istat)
+        self.add_default_ubifs_args(istat)
 
-        # icat
+    def _add_icat(self, subparsers: argparse._SubParsersAction) -> None:
         icat = subparsers.add_parser("icat", help="Outputs the data of an inode.")
         self.add_default_mtd_args(icat)
         icat.add_argument("inode", help="Inode number.", type=int)
-        icat.add_argument("--output", help="If specified, will output data to given file.", type=argparse.FileType('w'))
+        icat.add_argument("--output", help="If specified, will output data to given file.", type=str)
         icat.add_argument("--scan", "-s",
                           help="If set, will perform scanning for signatures instead of traversing the file-index for data nodes. NOTE: This needs to be set if trying to restore deleted inodes.",
                           default=False, action="store_true")
-        icat.set_defaults(func=self.icat)
+        self.add_default_ubi_args(icat)
 
-        # ils
+    def _add_ils(self, subparsers: argparse._SubParsersAction) -> None:
         ils = subparsers.add_parser("ils", help="Lists all inodes of a given UBIFS instance.")
         self.add_default_mtd_args(ils)
         ils.add_argument("--scan", "-s",
@@ -134,9 +199,10 @@ class CommandLine:
         ils.add_argument("--deleted", "-d",
                          help="Similar to scan. Will perform scanning for signatures instead of using the file index. Will only show deleted inodes. This will take priority over --scan.",
                          default=False, action="store_true")
-        ils.set_defaults(func=self.ils)
+        self.add_default_ubi_args(ils)
+        self.add_default_ubifs_args(ils)
 
-        # ffind
+    def _add_ffind(self, subparsers: argparse._SubParsersAction) -> None:
         ffind = subparsers.add_parser("ffind", help="Outputs directory entries associated with a given inode number.")
         self.add_default_mtd_args(ffind)
         ffind.add_argument("--path", "-p", help="If set, will output full paths for every file.", default=False,
@@ -145,14 +211,16 @@ class CommandLine:
         ffind.add_argument("--scan", "-s",
                            help="If set, will perform scanning for signatures instead of traversing the file-index for data nodes. NOTE: This needs to be set if trying to find directory entries for deleted inodes.",
                            default=False, action="store_true")
-        ffind.set_defaults(func=self.ffind)
+        self.add_default_ubi_args(ffind)
+        self.add_default_ubifs_args(ffind)
 
-        # jls
+    def _add_jls(self, subparsers: argparse._SubParsersAction) -> None:
         jls = subparsers.add_parser("jls", help="Lists all nodes within the journal.")
         self.add_default_mtd_args(jls)
-        jls.set_defaults(func=self.jls)
+        self.add_default_ubi_args(jls)
+        self.add_default_ubifs_args(jls)
 
-        # ubift_recover
+    def _add_ubift_recover(self, subparsers: argparse._SubParsersAction) -> None:
         # This command is used by the Autopsy plugin
         ubift_recover = subparsers.add_parser("ubift_recover",
                                               help="Extracts all files found in UBIFS instances. Creates one directory for each UBI volume with UBIFS.")
@@ -165,29 +233,21 @@ class CommandLine:
                                    default=False, action="store_true")
         ubift_recover.add_argument("--output",
                                    help="Output directory where all files and directories will be dumped to.", type=str)
-        ubift_recover.set_defaults(func=self.ubift_recover)
 
-        # ubift_info
+    def _add_ubift_info(self, subparsers: argparse._SubParsersAction) -> None:
         ubift_info = subparsers.add_parser("ubift_info",
                                            help="Outputs information regarding recoverability of deleted inodes. This parameter takes priority over all other parameters.")
         self.add_default_mtd_args(ubift_info)
         ubift_info.add_argument("--inode_info", "-ii",
                                 help="If set, will output recoverability information for every found deleted inode.",
                                 default=False, action="store_true")
-        ubift_info.set_defaults(func=self.ubift_info)
-
-        # Adds default arguments such as --offset to all previously defined commands that operate in the UBI layer
-        ubi_layer_commands = [lebls, jls, lebcat, ubicat, fls, istat, icat, ils, fsstat, ffind, ubift_info]
-        for command in ubi_layer_commands:
-            self.add_default_ubi_args(command)
+        self.add_default_ubi_args(ubift_info)
 
-        # Adds default arguments such as --master to all previously defined commands that operate in the UBIFS layer
-        ubifs_layer_commands = [fls, ffind, istat, ils, jls]
-        for command in ubifs_layer_commands:
-            self.add_default_ubifs_args(command)
-
-        args = parser.parse_args()
-        args.func(args)
+    def _add_batch(self, subparsers: argparse._SubParsersAction) -> None:
+        batch = subparsers.add_parser("batch",
+                                      help="Runs multiple commands, one per line of a file, in a single process. Each dump is only opened and partitioned once, UBI and UBIFS instances are shared by all commands that use them.")
+        batch.add_argument("commands",
+                           help="Path to a file with one command per line, e.g. 'icat /path/to/dump.bin -o 0 -n data 42 --output file', or '-' for stdin. Empty lines and lines starting with '#' are ignored, lines that are invalid or whose command fails are skipped.")
 
     def add_default_ubifs_args(self, parser: argparse.ArgumentParser) -> None:
         """
@@ -227,7 +287,7 @@ class CommandLine:
         :param parser: Parser that will have common arguments added
         :return:
         """
-        parser.add_argument("input", help="Path to input flash memory dump.")
+        parser.add_argument("input", help="Path to input flash memory dump. Use '-' to read the dump from stdin.")
 
         parser.add_argument("--oob", help="Out of Bounds size in Bytes. If specified, will automatically extract OOB.",
                             type=int)
@@ -247,25 +307,41 @@ class CommandLine:
     def _initialize_mtd(self, args: argparse.Namespace) -> Image:
         """
         Convenience method for initalizing an instance of Image with default args
-        :param path: Path to Flash dump
+        :param path: Path to Flash dump or '-' for stdin
         :param args: default args that contains blocksiz etc.
         :return: An instance of Image or None if it fails
         """
+        from ubift.framework.mtd import Image
+
         path = args.input
-        with open(path, "rb") as f:
-            data = f.read()
+        if path == "-":
+            data = sys.stdin.buffer.read()
+        else:
+            # The dump is mapped instead of read, so only the parts that are actually accessed are loaded into memory.
+            # The mapping stays valid after the file is closed and supports find() and slicing just like bytes.
+            # Empty files cannot be mapped, neither can devices (e.g., /dev/mtd0) which also report a size of 0, so
+            # they are read instead.
+            with open(path, "rb") as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    data = f.read()
+                else:
+                    data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            # Almost every command scans the whole dump for signatures, so the kernel may read it ahead in large chunks.
+            # MADV_SEQUENTIAL is not used since pages are accessed more than once. Not available on Windows.
+            if isinstance(data, mmap.mmap) and hasattr(mmap, "MADV_WILLNEED"):
+                data.madvise(mmap.MADV_WILLNEED)
 
-            oob_size = args.oob if args.oob is not None and args.oob > 0 else -1
-            page_size = args.pagesize if args.pagesize is not None and args.pagesize > 0 else -1
-            block_size = args.blocksize if args.blocksize is not None and args.blocksize > 0 else -1
+        oob_size = args.oob if args.oob is not None and args.oob > 0 else -1
+        page_size = args.pagesize if args.pagesize is not None and args.pagesize > 0 else -1
+        block_size = args.blocksize if args.blocksize is not None and args.blocksize > 0 else -1
 
-            mtd = Image(data, block_size, page_size, oob_size)
+        mtd = Image(data, block_size, page_size, oob_size)
 
-            peb_threshold = args.pebthreshold
-            if peb_threshold is not None:
-                setattr(mtd, "peb_threshold", peb_threshold)
+        peb_threshold = args.pebthreshold
+        if peb_threshold is not None:
+            setattr(mtd, "peb_threshold", peb_threshold)
 
-            return mtd
+        return mtd
 
     def _initialize_ubi(self, image: Image, args: argparse.Namespace) -> UBI:
         """
@@ -278,8 +354,7 @@ class CommandLine:
 
         for partition in image.partitions:
             if peb_offset == (partition.offset // image.block_size):
-                ubi = UBI(partition)
-                return ubi
+                return self._get_ubi(partition)
 
         raise exception.UBIFTException("[-] Cannot find UBI Instance. Maybe the offset is incorrect?")
 
@@ -299,13 +374,80 @@ class CommandLine:
 
         # Search by name
         if volname is not None and len(volname) > 0:
-            for ubivol in ubi.volumes:
-                if ubivol.name == volname:
-                    return ubivol
+            ubivol = ubi.get_volume(volname)
+            if ubivol is not None:
+                return ubivol
 
         raise exception.UBIFTException(
             "[-] Cannot find specified UBI Volume. Either the volname or volindex is invalid.")
 
+    def _open_mtd(self, args: argparse.Namespace) -> Image:
+        """
+        Same as _initialize_mtd, but the Image is cached per input file and default args. Since the UBIPartitioner
+        caches its results on the Image and every UBI instance is kept by its Partition, subsequent calls do not read,
+        partition or parse the dump again.
+        :param args: default args that contain the input, blocksize etc.
+        :return: The initialized Image
+        """
+        key = (args.input, args.blocksize, args.pagesize, args.oob, args.pebthreshold)
+        if key in self._images:
+            return self._images[key]
+
+        mtd = self._initialize_mtd(args)
+
+        # stdin can only be read once, so there is nothing to gain from keeping it
+        if args.input != "-":
+            self._images[key] = mtd
+        return mtd
+
+    def _open_ubi_volume(self, args: argparse.Namespace) -> tuple[Image, UBI, UBIVolume]:
+        """
+        Convenience method that initializes the Image, partitions it and initializes the UBI instance and the UBI volume
+        given by the default args (see _open_mtd, _initialize_ubi and _initialize_ubi_volume).
+        The result is cached per input file and default args, so subsequent calls do not parse the dump again.
+        :param args: default args that contain the input, blocksize, offset, volname etc.
+        :return: The initialized Image, UBI instance and UBI volume
+        """
+
+        key = (args.input, args.blocksize, args.pagesize, args.oob, args.pebthreshold, args.offset, args.volname,
+               args.volindex)
+        if key in self._ubi_volumes:
+            return self._ubi_volumes[key]
+
+        from ubift.framework.partitioner import UBIPartitioner
+
+        mtd = self._open_mtd(args)
+        mtd.partitions = UBIPartitioner().partition(mtd, fill_partitions=False)
+        ubi = self._initialize_ubi(mtd, args)
+        ubi_vol = self._initialize_ubi_volume(ubi, args)
+
+        # stdin can only be read once, so there is nothing to gain from keeping it
+        if args.input != "-":
+            self._ubi_volumes[key] = (mtd, ubi, ubi_vol)
+        return mtd, ubi, ubi_vol
+
+    def _open_ubifs(self, args: argparse.Namespace, masternode_index: int = -1) -> tuple[Image, UBI, UBIVolume, UBIFS]:
+        """
+        Convenience method that initializes the UBI volume given by the default args (see _open_ubi_volume) and the
+        UBIFS instance within it. The UBIFS instance is cached per UBI volume and master node, so commands that run on
+        the same UBIFS instance share its traversals and scans.
+        :param args: default args that contain the input, blocksize, offset, volname etc.
+        :param masternode_index: Index of the master node that will be used, -1 is the most recent one
+        :return: The initialized Image, UBI instance, UBI volume and UBIFS instance
+        """
+        from ubift.framework.ubifs import UBIFS
+
+        mtd, ubi, ubi_vol = self._open_ubi_volume(args)
+
+        key = (id(ubi_vol), masternode_index)
+        if key in self._ubifs:
+            return mtd, ubi, ubi_vol, self._ubifs[key]
+
+        ubifs = UBIFS(ubi_vol, masternode_index=masternode_index)
+        if args.input != "-":
+            self._ubifs[key] = ubifs
+        return mtd, ubi, ubi_vol, ubifs
+
     def _initialize_ubi_instances(self, image: Image, do_partitioning: bool = False) -> List[UBI]:
         """
         Convenience method for initalizing all UBI instances in an Image (requires the Partitions that include an UBI instance to be named "UBI")
@@ -313,6 +455,8 @@ class CommandLine:
         :param do_partitioning: If True, will partition the Image using an UBIPartitioner
         :return: List of initialized UBI instances
         """
+        from ubift.framework.partitioner import UBIPartitioner
+
         ubi_instances = []
 
         if do_partitioning:
@@ -320,20 +464,82 @@ class CommandLine:
 
         for partition in image.partitions:
             if partition.name == "UBI":
-                ubi = UBI(partition)
-                ubi_instances.append(ubi)
+                ubi_instances.append(self._get_ubi(partition))
         return ubi_instances
 
+    def _get_ubi(self, partition: Partition) -> UBI:
+        """
+        Gets the UBI instance of a Partition. It is only initialized if the Partition does not have one yet, since
+        the Partitions found by the UBIPartitioner are cached on the Image (see UBIPartitioner.partition).
+        :param partition: Partition that contains an UBI instance
+        :return: Instance of UBI
+        """
+        from ubift.framework.ubi import UBI
+
+        ubi = partition.ubi_instance if partition.ubi_instance is not None else UBI(partition)
+        self._ubi_instances.add(ubi)
+        return ubi
+
     @classmethod
     def verbose(cls, args: argparse.Namespace) -> None:
         """
-        Checks if --verbose is set True, if not, will disable logging.
+        Checks if --verbose is set True, if not, will only log errors.
+        This sets the level of the root logger (which all loggers of UBIFT propagate to) instead of disabling
+        logging globally, so that disabled messages are rejected by the first level check. The level is set either way,
+        since multiple commands with different --verbose can run in the same process (see 'batch').
+        :param args:
+        :return:
+        """
+        if hasattr(args, "verbose"):
+            rootlog.setLevel(VERBOSE_LOG_LEVEL if args.verbose else logging.ERROR)
+
+    def batch(self, args: argparse.Namespace) -> None:
+        """
+        Runs all commands of a file one after another. Since they run in the same process, the Image, UBI instances
+        and UBIFS instances opened by one command are reused by the following ones (see _open_mtd, _open_ubi_volume
+        and _open_ubifs), instead of parsing the dump again for every command.
         :param args:
         :return:
         """
-        if hasattr(args, "verbose") and args.verbose is False:
-            logging.disable(logging.INFO)
-            logging.disable(logging.WARN)
+        import shlex
+
+        commands = {name: command for name, command in self._commands().items() if name != "batch"}
+        parser = self._create_parser(commands)
+
+        if args.commands == "-":
+            lines = sys.stdin.read().splitlines()
+        else:
+            with open(args.commands, "r") as f:
+                lines = f.read().splitlines()
+
+        self._in_batch = True
+        for line_num, line in enumerate(lines, start=1):
+            line = line.strip()
+            if len(line) == 0 or line.startswith("#"):
+                continue
+            # argparse exits on invalid arguments (after printing the error), which only skips this command
+            try:
+                command_args = parser.parse_args(shlex.split(line))
+            except SystemExit:
+                rootlog.error(f"[-] Skipping invalid command in line {line_num}: {line}")
+                continue
+            try:
+                commands[command_args.command][1](command_args)
+            # Besides UBIFTException, a mistyped path raises an OSError and an empty dump a ValueError (e.g., when
+            # guessing sizes). Both only concern this line.
+            except (exception.UBIFTException, OSError, ValueError) as e:
+                rootlog.error(f"[-] Command in line {line_num} failed: {e}")
+            finally:
+                self._clear_leb_data()
+
+    def _clear_leb_data(self) -> None:
+        """
+        Releases the data of LEBs kept by all UBI instances that were used so far (see UBI.clear_leb_data). The UBI
+        instances themselves stay cached.
+        :return:
+        """
+        for ubi in self._ubi_instances:
+            ubi.clear_leb_data()
 
     def ubift_info(self, args) -> None:
         """
@@ -341,15 +547,14 @@ class CommandLine:
         :param args:
         :return:
         """
+        from ubift.cli import renderer
+        from ubift.framework import visitor
+
         CommandLine.verbose(args)
 
         inode_info = args.inode_info
 
-        mtd = self._initialize_mtd(args)
-        mtd.partitions = UBIPartitioner().partition(mtd, fill_partitions=False)
-        ubi = self._initialize_ubi(mtd, args)
-        ubi_vol = self._initialize_ubi_volume(ubi, args)
-        ubifs = UBIFS(ubi_vol)
+        mtd, ubi, ubi_vol, ubifs = self._open_ubifs(args)
 
         scanned_inodes = {}
         scanned_dents = {}
@@ -366,6 +571,9 @@ class CommandLine:
         :param args:
         :return:
         """
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
         CommandLine.verbose(args)
 
         output_dir = args.output
@@ -377,137 +585,222 @@ class CommandLine:
         else:
             rootlog.info(f"[!] Extracting all files to {output_dir}")
 
-        image = self._initialize_mtd(args)
+        image = self._open_mtd(args)
         ubi_instances = self._initialize_ubi_instances(image, True)
 
+        volumes = []
         for i, ubi in enumerate(ubi_instances):
             ubi_dir = os.path.join(output_dir, f"ubi_{i}")
-            if not os.path.exists(ubi_dir):
-                os.mkdir(ubi_dir)
-                rootlog.info(f"[+] Creating directory {ubi_dir}")
+            os.makedirs(ubi_dir, exist_ok=True)
+            rootlog.info(f"[+] Creating directory {ubi_dir}")
 
             for j, ubi_vol in enumerate(ubi.volumes):
                 # Create dir for UBI volume, e.g., ubi_0_1_data
                 ubi_vol_name = ubi_vol.name if len(ubi_vol.name) <= 10 else ubi_vol.name[:10]
                 ubi_vol_dir = os.path.join(ubi_dir, f"ubi_{i}_{j}_{ubi_vol_name}")
-                if not os.path.exists(ubi_vol_dir):
-                    os.mkdir(ubi_vol_dir)
-                    rootlog.info(f"[+] Creating directory {ubi_vol_dir}")
-
-                ubifs = UBIFS(ubi_vol)
-                if ubifs is None or (not ubifs._used_masternode and not ubifs.superblock):
-                    # Output ubi volume as binary data
-                    ubi_raw_data_path = "RAW_UBI_VOL_DATA.bin"
-                    full_path = os.path.join(ubi_vol_dir, ubi_raw_data_path)
-                    with open(full_path, "wb") as f:
-                        f.write(ubi_vol.get_data())
-                        rootlog.info(f"[+] Wrote raw UBI volume data to: {full_path}")
-                    continue
-
-                inodes = {}
-                dents = {}
-                data = {}
-                if hasattr(ubifs, "_root_idx_node"): # TODO: Temporary fix if there are no master nodes
-                    ubifs._traverse(ubifs._root_idx_node, visitor._inode_dent_data_collector_visitor, inodes=inodes,
-                                    dents=dents, data=data)
-
-                if deleted:
-                    scanned_inodes = {}
-                    scanned_dents = {}
-                    scanned_data_nodes = {}
-                    ubifs._scan_lebs(visitor._all_collector_visitor, inodes=scanned_inodes, dents=scanned_dents,
-                                     datanodes=scanned_data_nodes)
-
-                for dent_list in dents.values():
-                    for dent in dent_list:
-                        if UBIFS_INODE_TYPES(dent.type) == UBIFS_INODE_TYPES.UBIFS_ITYPE_DIR:
-                            full_dir = os.path.join(ubi_vol_dir, ubifs._unroll_path(dent, dents))
-                            rootlog.info(f"[+] Creating directory {full_dir}")
-                            try:
-                                os.makedirs(full_dir, exist_ok=True)
-                            except:
-                                sanitized_path = sanitize_filepath(full_dir)
-                                rootlog.info(f"[!] Sanitizing filepath {full_dir} to {sanitized_path}")
-                                os.makedirs(sanitized_path, exist_ok=True)
-                            inode_num = dent.inum
-                            if inode_num in inodes:
-                                atime = inodes[inode_num].atime_sec + inodes[inode_num].atime_nsec / 1000000000.0
-                                mtime = inodes[inode_num].mtime_sec + inodes[inode_num].mtime_nsec / 1000000000.0
-                                try:
-                                    os.utime(full_dir, (atime, mtime))
-                                    os.chmod(full_dir, inodes[inode_num].mode)
-                                except:
-                                    pass # TODO: print verbose warning msg
-                        elif UBIFS_INODE_TYPES(dent.type) == UBIFS_INODE_TYPES.UBIFS_ITYPE_REG:
-                            inode_num = dent.inum
-                            full_filepath = os.path.join(ubi_vol_dir, ubifs._unroll_path(dent, dents))
-                            os.makedirs(os.path.dirname(full_filepath), exist_ok=True)
-                            if inode_num not in inodes or inode_num not in data or len(data[inode_num]) == 0:
-                                rootlog.warning(
-                                    f"[-] Cannot create file because cannot find its inode ({inode_num not in inodes}) or it has no data nodes ({inode_num not in data}): {full_filepath}")
-                                continue
-                            write_to_file(inodes[inode_num], data[inode_num], full_filepath)
-                            atime = inodes[inode_num].atime_sec + inodes[inode_num].atime_nsec / 1000000000.0
-                            mtime = inodes[inode_num].mtime_sec + inodes[inode_num].mtime_nsec / 1000000000.0
-                            try:
-                                os.utime(full_filepath, (atime, mtime))
-                                os.chmod(full_filepath, inode.mode)
-                            except:
-                                pass
-                            rootlog.info(f"[+] Creating file {full_filepath}")
-                        elif UBIFS_INODE_TYPES(dent.type) == UBIFS_INODE_TYPES.UBIFS_ITYPE_LNK:
-                            rootlog.warning(f"[!] Encountered type LNK (will be skipped): {dent.formatted_name()}")
-                        elif UBIFS_INODE_TYPES(dent.type) == UBIFS_INODE_TYPES.UBIFS_ITYPE_BLK:
-                            rootlog.warning(f"[!] Encountered type BLK (will be skipped): {dent.formatted_name()}")
-                        elif UBIFS_INODE_TYPES(dent.type) == UBIFS_INODE_TYPES.UBIFS_ITYPE_CHR:
-                            rootlog.warning(f"[!] Encountered type CHR (will be skipped): {dent.formatted_name()}")
-                        elif UBIFS_INODE_TYPES(dent.type) == UBIFS_INODE_TYPES.UBIFS_ITYPE_FIFO:
-                            rootlog.warning(f"[!] Encountered type FIFO (will be skipped): {dent.formatted_name()}")
-                        elif UBIFS_INODE_TYPES(dent.type) == UBIFS_INODE_TYPES.UBIFS_ITYPE_SOCK:
-                            rootlog.warning(f"[!] Encountered type SOCK (will be skipped): {dent.formatted_name()}")
-                        else:
-                            rootlog.warning(
-                                f"[!] Encountered unknown type (will be skipped): {dent.formatted_name()}")
-
-                if not deleted:
-                    continue
-
-                rootlog.info(f"[+] Recovering deleted files.")
-                deleted_dir = os.path.join(ubi_vol_dir, "UBIFT_RECOVERED_FILES")
-                if not os.path.exists(deleted_dir):
-                    os.mkdir(deleted_dir)
-
-                for inode_num, inode in scanned_inodes.items():
-                    if inode_num in inodes:  # This file is in the file index, so ignore it here.
-                        continue
-                    # TODO: maybe restore full path instead of putting everything into the recovered-folder
-                    # TODO: Skip if not a regular file
-                    # full_filepath = os.path.join(ubi_vol_dir, ubifs._unroll_path(dent, dents))
-                    # os.makedirs(os.path.dirname(full_filepath), exist_ok=True)
-                    if inode_num not in scanned_data_nodes or len(scanned_data_nodes[inode_num]) == 0:
-                        name = ""
-                        if inode_num in scanned_dents and len(scanned_dents[inode_num]) > 0:
-                            name = scanned_dents[inode_num][0].formatted_name()
-                        rootlog.warning(
-                            f"[-] Cannot recover deleted inode {inode_num} ({name}) because there are no more data nodes for it.")
-                        continue
+                os.makedirs(ubi_vol_dir, exist_ok=True)
+                rootlog.info(f"[+] Creating directory {ubi_vol_dir}")
+                volumes.append((ubi_vol, ubi_vol_dir))
+
+        # UBI volumes are independent of each other and are written to different directories, so they are recovered
+        # in parallel. This requires worker processes to be forked, since the volumes reference the whole image and
+        # would otherwise have to be pickled. Forking is only safe on Linux (macOS defaults to spawn for that reason).
+        # Within 'batch', every fork would also copy all cached Images and UBIFS instances, so volumes are recovered
+        # one after another there.
+        if len(volumes) > 1 and sys.platform.startswith("linux") and not self._in_batch:
+            with ProcessPoolExecutor(max_workers=min(os.cpu_count() or 1, len(volumes)),
+                                     mp_context=multiprocessing.get_context("fork"),
+                                     initializer=_init_recover_worker, initargs=(volumes,)) as executor:
+                futures = [executor.submit(_recover_job, index, deleted) for index in range(len(volumes))]
+                # Propagates exceptions that occurred while recovering a volume
+                for future in futures:
+                    future.result()
+        else:
+            for ubi_vol, ubi_vol_dir in volumes:
+                self._recover_ubi_volume(ubi_vol, ubi_vol_dir, deleted)
 
-                    if inode_num in scanned_dents and len(scanned_dents[inode_num]) > 0:
-                        full_filepath = os.path.join(deleted_dir, scanned_dents[inode_num][0].formatted_name())
-                    else:
-                        full_filepath = os.path.join(deleted_dir, f"RECOVERED_INODE_DATA_{inode_num}")
+    def _recover_ubi_volume(self, ubi_vol: UBIVolume, ubi_vol_dir: str, deleted: bool) -> None:
+        """
+        Recovers all files of the UBIFS instance within a UBI volume, see 'ubift_recover'.
+        If the volume does not contain UBIFS, its raw data is written instead.
+        :param ubi_vol: UBI volume to recover files from
+        :param ubi_vol_dir: Existing directory the files will be written to
+        :param deleted: If True, inodes that are not part of the file index will be recovered too
+        :return:
+        """
+        from ubift.cli.renderer import write_to_file
+        from ubift.framework import visitor
+        from ubift.framework.structs.ubifs_structs import UBIFS_INODE_TYPES
+        from ubift.framework.ubifs import UBIFS
+
+        # The type of every dent is compared against plain ints instead of creating an enum instance for every comparison
+        itype_dir = UBIFS_INODE_TYPES.UBIFS_ITYPE_DIR.value
+        itype_reg = UBIFS_INODE_TYPES.UBIFS_ITYPE_REG.value
+        # Types that are not recovered, mapped to the name they are reported with
+        skipped_itypes = {UBIFS_INODE_TYPES.UBIFS_ITYPE_LNK.value: "LNK",
+                          UBIFS_INODE_TYPES.UBIFS_ITYPE_BLK.value: "BLK",
+                          UBIFS_INODE_TYPES.UBIFS_ITYPE_CHR.value: "CHR",
+                          UBIFS_INODE_TYPES.UBIFS_ITYPE_FIFO.value: "FIFO",
+                          UBIFS_INODE_TYPES.UBIFS_ITYPE_SOCK.value: "SOCK"}
 
-                    write_to_file(inode, scanned_data_nodes[inode_num], full_filepath)
+        ubifs = UBIFS(ubi_vol)
+        if ubifs is None or (not ubifs._used_masternode and not ubifs.superblock):
+            # Output ubi volume as binary data
+            ubi_raw_data_path = "RAW_UBI_VOL_DATA.bin"
+            full_path = os.path.join(ubi_vol_dir, ubi_raw_data_path)
+            with open(full_path, "wb") as f:
+                f.write(ubi_vol.get_data())
+                rootlog.info(f"[+] Wrote raw UBI volume data to: {full_path}")
+            return
 
-                    atime = inode.atime_sec + inode.atime_nsec / 1000000000.0
-                    mtime = inode.mtime_sec + inode.mtime_nsec / 1000000000.0
+        inodes = {}
+        dents = {}
+        data = {}
+        if hasattr(ubifs, "_root_idx_node"): # TODO: Temporary fix if there are no master nodes
+            ubifs._traverse(ubifs._root_idx_node, visitor._inode_dent_data_collector_visitor, inodes=inodes,
+                            dents=dents, data=data)
+
+        if deleted:
+            # Only inodes that are not in the file index are recovered from the scan, nodes of all other inodes
+            # are not kept in memory
+            scanned_inodes = {}
+            scanned_dents = {}
+            scanned_data_nodes = {}
+            ubifs._scan_lebs(visitor._all_collector_visitor, inodes=scanned_inodes, dents=scanned_dents,
+                             datanodes=scanned_data_nodes, ignored_inodes=inodes.keys())
+
+        # Access and modification times as well as the mode of every inode, which can be referenced by more than one dent
+        inode_times = {inum: self._inode_metadata(inode) for inum, inode in inodes.items()}
+
+        # Directories known to exist, so that os.makedirs() does not check all of their ancestors again for every file
+        created_dirs = {ubi_vol_dir}
+        # Unrolled paths of directories by their inode number, shared by all dents of the volume
+        paths = {}
+        # Messages below are logged for every dent or inode. They are formatted lazily by logging (%-style), messages
+        # that need more work than formatting, e.g., formatting the name of a dent, are only built if they are logged.
+        warning_enabled = rootlog.isEnabledFor(logging.WARNING)
+
+        for dent_list in dents.values():
+            for dent in dent_list:
+                dent_type = dent.type
+                if dent_type == itype_dir:
+                    full_dir = os.path.join(ubi_vol_dir, ubifs._unroll_path(dent, dents, paths))
+                    rootlog.info("[+] Creating directory %s", full_dir)
                     try:
-                        os.utime(full_dir, (atime, mtime))
-                        os.chmod(full_dir, inode.mode)
+                        os.makedirs(full_dir, exist_ok=True)
+                        created_dirs.add(full_dir)
                     except:
-                        pass
+                        from pathvalidate import sanitize_filepath
+                        sanitized_path = sanitize_filepath(full_dir)
+                        rootlog.info(f"[!] Sanitizing filepath {full_dir} to {sanitized_path}")
+                        os.makedirs(sanitized_path, exist_ok=True)
+                        created_dirs.add(sanitized_path)
+                    inode_num = dent.inum
+                    if inode_num in inode_times:
+                        self._set_metadata(full_dir, *inode_times[inode_num])
+                elif dent_type == itype_reg:
+                    inode_num = dent.inum
+                    full_filepath = os.path.join(ubi_vol_dir, ubifs._unroll_path(dent, dents, paths))
+                    parent_dir = os.path.dirname(full_filepath)
+                    if parent_dir not in created_dirs:
+                        os.makedirs(parent_dir, exist_ok=True)
+                        created_dirs.add(parent_dir)
+                    inode = inodes.get(inode_num)
+                    inode_data_nodes = data.get(inode_num)
+                    if inode is None or not inode_data_nodes:
+                        rootlog.warning(
+                            "[-] Cannot create file because cannot find its inode (%s) or it has no data nodes (%s): %s",
+                            inode is None, inode_data_nodes is None, full_filepath)
+                        continue
+                    write_to_file(inode, inode_data_nodes, full_filepath)
+                    self._set_metadata(full_filepath, *inode_times[inode_num])
+                    rootlog.info("[+] Creating file %s", full_filepath)
+                elif dent_type in skipped_itypes:
+                    if warning_enabled:
+                        rootlog.warning(f"[!] Encountered type {skipped_itypes[dent_type]} (will be skipped): {dent.formatted_name()}")
+                elif warning_enabled:
+                    rootlog.warning(
+                        f"[!] Encountered unknown type (will be skipped): {dent.formatted_name()}")
+
+        if not deleted:
+            return
 
-                    rootlog.info(f"[+] Recovering file {full_filepath} from inode {inode_num}.")
+        rootlog.info(f"[+] Recovering deleted files.")
+        deleted_dir = os.path.join(ubi_vol_dir, "UBIFT_RECOVERED_FILES")
+        os.makedirs(deleted_dir, exist_ok=True)
+
+        for inode_num, inode in scanned_inodes.items():
+            if inode_num in inodes:  # This file is in the file index, so ignore it here.
+                continue
+            # TODO: maybe restore full path instead of putting everything into the recovered-folder
+            # TODO: Skip if not a regular file
+            # full_filepath = os.path.join(ubi_vol_dir, ubifs._unroll_path(dent, dents))
+            # os.makedirs(os.path.dirname(full_filepath), exist_ok=True)
+            # Each of the scanned dicts is only looked up once per inode
+            inode_dents = scanned_dents.get(inode_num)
+            name = inode_dents[0].formatted_name() if inode_dents else None
+            inode_data_nodes = scanned_data_nodes.get(inode_num)
+            if not inode_data_nodes:
+                rootlog.warning("[-] Cannot recover deleted inode %s (%s) because there are no more data nodes for it.",
+                                inode_num, name or "")
+                continue
+
+            if name is not None:
+                full_filepath = os.path.join(deleted_dir, name)
+            else:
+                full_filepath = os.path.join(deleted_dir, f"RECOVERED_INODE_DATA_{inode_num}")
+
+            write_to_file(inode, inode_data_nodes, full_filepath)
+            self._set_metadata(full_filepath, *self._inode_metadata(inode))
+
+            rootlog.info("[+] Recovering file %s from inode %s.", full_filepath, inode_num)
+
+    @staticmethod
+    def _write_stdout(views: Iterable[memoryview], chunk_size: int = 1 << 20) -> None:
+        """
+        Writes binary data straight to the file descriptor of stdout, in chunks of at most 'chunk_size' bytes.
+        Writing views into the image avoids copying the data (e.g., a whole UBI volume) into memory first.
+        :param views: memoryviews that will be written one after another
+        :param chunk_size: Maximum amount of bytes per write
+        :return:
+        """
+        sys.stdout.flush()
+        fd = sys.stdout.fileno()
+        for view in views:
+            for offset in range(0, len(view), chunk_size):
+                chunk = view[offset:offset + chunk_size]
+                while len(chunk) > 0:
+                    chunk = chunk[os.write(fd, chunk):]
+
+    @staticmethod
+    def _inode_metadata(inode: UBIFS_INO_NODE) -> tuple[int, int, int]:
+        """
+        Fetches the metadata of an inode that is applied to recovered files and directories.
+        :param inode:
+        :return: Access time (ns), modification time (ns) and mode of the inode, as expected by '_set_metadata'
+        """
+        return (inode.atime_sec * 1000000000 + inode.atime_nsec,
+                inode.mtime_sec * 1000000000 + inode.mtime_nsec,
+                inode.mode)
+
+    @staticmethod
+    def _set_metadata(path: str, atime_ns: int, mtime_ns: int, mode: int) -> None:
+        """
+        Applies the times and mode of an inode to a recovered file or directory.
+        Times or a mode that are not set (zero) are skipped, as there is nothing to restore.
+        :param path: Path to recovered file or directory
+        :param atime_ns: Access time in nanoseconds
+        :param mtime_ns: Modification time in nanoseconds
+        :param mode: Mode of the inode
+        :return:
+        """
+        try:
+            if atime_ns or mtime_ns:
+                os.utime(path, ns=(atime_ns, mtime_ns))
+            if mode:
+                os.chmod(path, mode)
+        except OSError as e:
+            rootlog.warning(f"[!] Cannot restore times or mode of {path}: {e}")
 
     def istat(self, args) -> None:
         """
@@ -515,39 +808,32 @@ class CommandLine:
         :param args:
         :return:
         """
+        from ubift.cli.renderer import render_inode_node
+        from ubift.framework import visitor
+        from ubift.framework.structs.ubifs_structs import UBIFS_KEY, UBIFS_KEY_TYPES
+
         CommandLine.verbose(args)
 
         do_scan = args.scan
         inode_num = args.inode
 
-        mtd = self._initialize_mtd(args)
-        mtd.partitions = UBIPartitioner().partition(mtd, fill_partitions=False)
-        ubi = self._initialize_ubi(mtd, args)
-        ubi_vol = self._initialize_ubi_volume(ubi, args)
-        ubifs = UBIFS(ubi_vol)
-
         if inode_num <= 0:
             rootlog.error(f"[-] Invalid inode number {inode_num}.")
             return
 
+        mtd, ubi, ubi_vol, ubifs = self._open_ubifs(args)
+
         # Construct key and try to find it in B-Tree
         inode_node_key = UBIFS_KEY.create_key(inode_num, UBIFS_KEY_TYPES.UBIFS_INO_KEY, 0)
         if do_scan:
             # TODO: When scanning, multiple inodes can possibly be found (the original one and the deletion one with nlink=0)
             #   Therefore maybe it is necessary to utilize dict[int, list] approach for scan methods instead of mere lists
-            dents = {}
-            inodes = {}
-            datanodes = {}
-            ubifs._scan_lebs(visitor._all_collector_visitor, inodes=inodes, dents=dents,
-                             datanodes=datanodes)
-            if inode_num in inodes:
-                node = inodes[inode_num]
-            else:
-                node = None
+            inodes, _, _, _ = ubifs._cached_scan(visitor._all_collector_visitor)
+            node = inodes.get(inode_num)
         else:
             node = ubifs._find(ubifs._root_idx_node, inode_node_key)
 
-        if node == None or inode_node_key != UBIFS_KEY(bytes(node.key[:8])):
+        if node == None or not inode_node_key.matches(node.key):
             rootlog.error(
                 f"[-] Inode {inode_num} could not be found.")
         else:
@@ -558,14 +844,10 @@ class CommandLine:
                 ubiftlog.info(f"[+] Found {len(xattrs)} extended attributes for inode {inode_num}")
                 sys.stdout.write(f"Extended Attributes:\n")
                 for xent, xent_inode in xattrs:
-                    xent_data = [f"{x:x}" for x in list(xent_inode.data)]
-                    xent_data = "".join(xent_data)
-                    try:
-                        u = bytearray(xent_inode.data).hex()
-                        b = codecs.decode(u, "hex")
-                        result = b.decode("ascii", errors="ignore")
-                    except:
-                        result = ""
+                    # The inode of an extended attribute may not be found when scanning
+                    raw = bytes(xent_inode.data) if xent_inode is not None else b""
+                    xent_data = raw.hex()
+                    result = raw.decode("ascii", errors="ignore")
                     sys.stdout.write(f"{xent.formatted_name()} --> {xent_data} ({result})\n")
 
     def _get_xattrs(self, ubifs: UBIFS, inode_num: int, do_scan: bool) -> list[tuple[UBIFS_DENT_NODE, UBIFS_INO_NODE]]:
@@ -577,27 +859,23 @@ class CommandLine:
         :param inode_num:
         :return: A dictionary of xent nodes (UBIFS_DENT_NODE with specific key) mapping to inodes representing the extended attributes
         """
+        from ubift.framework import visitor
+        from ubift.framework.structs.ubifs_structs import UBIFS_KEY, UBIFS_KEY_TYPES
+
+        # Uses the same visitors as 'istat' and 'fls', so the nodes are only collected once per command
         if do_scan:
-            dents = {}
-            xentries = {}
-            ubifs._scan_lebs(visitor._dent_xent_scan_leb_visitor, dents=dents, xentries=xentries)
+            inodes, _, xentries, _ = ubifs._cached_scan(visitor._all_collector_visitor)
         else:
-            inodes = {}
-            dents = {}
-            xentries = {}
-            ubifs._traverse(ubifs._root_idx_node, visitor._inode_dent_xent_collector_visitor, inodes=inodes,
-                            dents=dents, xentries=xentries)
+            inodes, _, xentries, _ = ubifs._cached_traverse(visitor._inode_dent_xent_collector_visitor)
         xents = []
-        for k,v in xentries.items():
-            for xent in v:
-                host_inum = UBIFS_KEY.from_bytearray(xent.key).inode_num
-                if host_inum == inode_num:
-                    if do_scan:
-                        xents.append((xent, inodes[xent.inum] if xent.inum in inodes else None))
-                    else:
-                        inode_node_xent_key = UBIFS_KEY.create_key(xent.inum, UBIFS_KEY_TYPES.UBIFS_INO_KEY, 0)
-                        xent_inode = ubifs._find(ubifs._root_idx_node, inode_node_xent_key)
-                        xents.append((xent, xent_inode))
+        # xentries are keyed by the inode number of their host inode (see visitor.py)
+        for xent in xentries.get(inode_num, ()):
+            if do_scan:
+                xents.append((xent, inodes.get(xent.inum)))
+            else:
+                inode_node_xent_key = UBIFS_KEY.create_key(xent.inum, UBIFS_KEY_TYPES.UBIFS_INO_KEY, 0)
+                xent_inode = ubifs._find(ubifs._root_idx_node, inode_node_xent_key)
+                xents.append((xent, xent_inode))
 
         return xents
 
@@ -607,13 +885,11 @@ class CommandLine:
         :param args:
         :return:
         """
+        from ubift.cli import renderer
+
         CommandLine.verbose(args)
 
-        mtd = self._initialize_mtd(args)
-        mtd.partitions = UBIPartitioner().partition(mtd, fill_partitions=False)
-        ubi = self._initialize_ubi(mtd, args)
-        ubi_vol = self._initialize_ubi_volume(ubi, args)
-        ubifs = UBIFS(ubi_vol)
+        mtd, ubi, ubi_vol, ubifs = self._open_ubifs(args)
 
         renderer.render_journal(mtd, ubifs, ubifs.journal)
 
@@ -624,27 +900,21 @@ class CommandLine:
         :param args:
         :return:
         """
+        from ubift.cli.renderer import render_inode_list
+        from ubift.framework import visitor
+
         CommandLine.verbose(args)
 
         do_scan = args.scan
         deleted = args.deleted
 
-        mtd = self._initialize_mtd(args)
-        mtd.partitions = UBIPartitioner().partition(mtd, fill_partitions=False)
-        ubi = self._initialize_ubi(mtd, args)
-        ubi_vol = self._initialize_ubi_volume(ubi, args)
-        ubifs = UBIFS(ubi_vol)
+        mtd, ubi, ubi_vol, ubifs = self._open_ubifs(args)
 
-        dents = {}
-        inodes = {}
-        datanodes = {}
         if do_scan or deleted:
-            ubifs._scan_lebs(visitor._all_collector_visitor, inodes=inodes, dents=dents,
-                             datanodes=datanodes)
+            inodes, dents, _, datanodes = ubifs._cached_scan(visitor._all_collector_visitor)
             render_inode_list(mtd, ubifs, inodes, deleted=deleted, datanodes=datanodes, dents=dents)
         else:
-            ubifs._traverse(ubifs._root_idx_node, visitor._inode_dent_collector_visitor, inodes=inodes,
-                            dents=dents)
+            inodes, _, _, _ = ubifs._cached_traverse(visitor._inode_dent_collector_visitor)
             render_inode_list(mtd, ubifs, inodes)
 
     def icat(self, args) -> None:
@@ -653,40 +923,37 @@ class CommandLine:
         :param args:
         :return:
         """
+        from ubift.cli.renderer import render_data_nodes
+        from ubift.framework import visitor
+        from ubift.framework.structs.ubifs_structs import UBIFS_KEY, UBIFS_KEY_TYPES
+
         CommandLine.verbose(args)
 
         inode_num = args.inode
         do_scan = args.scan
-        output = args.output if args.output is not None else sys.stdout
 
-        mtd = self._initialize_mtd(args)
-        mtd.partitions = UBIPartitioner().partition(mtd, fill_partitions=False)
-        ubi = self._initialize_ubi(mtd, args)
-        ubi_vol = self._initialize_ubi_volume(ubi, args)
-        ubifs = UBIFS(ubi_vol)
+        mtd, ubi, ubi_vol, ubifs = self._open_ubifs(args)
 
-        data_nodes = []
+        inodes = None
         # For deleted content a scan has to be performed otherwise the data nodes cannot be found
         if do_scan:
-            dents = {}
-            inodes = {}
-            datanodes = {}
-            ubifs._scan_lebs(visitor._all_collector_visitor, inodes=inodes, dents=dents,
-                             datanodes=datanodes)
-            if inode_num in datanodes:
-                data_nodes = datanodes[inode_num]
-            render_data_nodes(ubifs, inode_num, data_nodes, output, inodes=inodes)
+            inodes, _, _, datanodes = ubifs._cached_scan(visitor._all_collector_visitor)
+            data_nodes = datanodes.get(inode_num, [])
         else:
             # Find all data nodes for given inode number
             min_key = UBIFS_KEY.create_key(inode_num, UBIFS_KEY_TYPES.UBIFS_DATA_KEY, 0)
             max_key = UBIFS_KEY.create_key(inode_num, UBIFS_KEY_TYPES.UBIFS_DATA_KEY + 1, 0)
             data_nodes = ubifs._find_range(ubifs._root_idx_node, min_key, max_key)
-            render_data_nodes(ubifs, inode_num, data_nodes, output)
 
-        # ubiftlog.error(
-        #     f"[-] UBI Volume {ubi_vol_name} could not be found. Use 'mtdls' and 'ubils' to determine available UBI instances and their volumes.")
-        # output.close()
-        # os.remove(output.name)
+        # The output file is only created once the UBIFS instance could be opened, so an existing file is not
+        # truncated by an invocation that fails anyway. stdout stays open for following commands (see 'batch').
+        if args.output is None:
+            # Text that is still buffered by stdout (e.g., by a previous command) is written before the binary data
+            sys.stdout.flush()
+            render_data_nodes(ubifs, inode_num, data_nodes, sys.stdout.buffer, inodes=inodes)
+        else:
+            with open(args.output, "wb") as output:
+                render_data_nodes(ubifs, inode_num, data_nodes, output, inodes=inodes)
 
     def ffind(self, args) -> None:
         """
@@ -695,6 +962,9 @@ class CommandLine:
         :param args:
         :return:
         """
+        from ubift.cli.renderer import render_dents
+        from ubift.framework import visitor
+
         CommandLine.verbose(args)
 
         use_full_paths = args.path
@@ -702,33 +972,18 @@ class CommandLine:
         do_scan = args.scan
         master_node_index = args.master
 
-        mtd = self._initialize_mtd(args)
-        mtd.partitions = UBIPartitioner().partition(mtd, fill_partitions=False)
-        ubi = self._initialize_ubi(mtd, args)
-        ubi_vol = self._initialize_ubi_volume(ubi, args)
-        ubifs = UBIFS(ubi_vol, masternode_index=master_node_index)
+        mtd, ubi, ubi_vol, ubifs = self._open_ubifs(args, masternode_index=master_node_index)
 
-        # Traverse B-Tree and collect all dents (inodes dont matter here but are collected too)
+        # Traverse B-Tree (or scan) and only collect the dents that refer to the given inode number
+        # A range query (see UBIFS._find_range) does not help here, since the key of a dent contains the inode number
+        # of its parent directory and not the one it refers to.
         # TODO: Maybe traverse etc shouldnt be protected functions
+        dents = {}
         if do_scan:
-            dents = {}
-            ubifs._scan_lebs(visitor._dent_scan_leb_visitor, dents=dents)
-            if inode_number not in dents:
-                dents = {}
-            else:
-                dents = {inode_number: dents[inode_number]}
-            render_dents(ubifs, dents, use_full_paths)
+            ubifs._scan_lebs(visitor._dent_scan_leb_visitor, dents=dents, inum=inode_number)
         else:
-            # TODO: This can be done more efficiently with traverse_range for the dents
-            inodes = {}
-            dents = {}
-            ubifs._traverse(ubifs._root_idx_node, visitor._inode_dent_collector_visitor, inodes=inodes,
-                            dents=dents)
-            if inode_number not in dents:
-                dents = {}
-            else:
-                dents = {inode_number: dents[inode_number]}
-            render_dents(ubifs, dents, use_full_paths)
+            ubifs._traverse(ubifs._root_idx_node, visitor._dent_scan_leb_visitor, dents=dents, inum=inode_number)
+        render_dents(ubifs, dents, use_full_paths)
 
     def fls(self, args) -> None:
         """
@@ -737,6 +992,9 @@ class CommandLine:
         :param args:
         :return:
         """
+        from ubift.cli.renderer import render_dents, render_xents
+        from ubift.framework import visitor
+
         CommandLine.verbose(args)
         use_full_paths = args.path
         do_scan = args.scan
@@ -744,24 +1002,14 @@ class CommandLine:
         deleted = args.deleted
         output_xentries = args.xentries
 
-        mtd = self._initialize_mtd(args)
-        mtd.partitions = UBIPartitioner().partition(mtd, fill_partitions=False)
-        ubi = self._initialize_ubi(mtd, args)
-        ubi_vol = self._initialize_ubi_volume(ubi, args)
-        ubifs = UBIFS(ubi_vol, masternode_index=master_node_index)
+        mtd, ubi, ubi_vol, ubifs = self._open_ubifs(args, masternode_index=master_node_index)
 
         # Traverse B-Tree and collect all dents (inodes dont matter here but are collected too)
         # TODO: Maybe traverse etc shouldnt be protected functions
         if do_scan or deleted:
-            dents = {}
-            xentries = {}
-            ubifs._scan_lebs(visitor._dent_xent_scan_leb_visitor, dents=dents, xentries=xentries)
+            _, dents, xentries, _ = ubifs._cached_scan(visitor._dent_xent_scan_leb_visitor)
         else:
-            inodes = {}
-            dents = {}
-            xentries = {}
-            ubifs._traverse(ubifs._root_idx_node, visitor._inode_dent_xent_collector_visitor, inodes=inodes,
-                            dents=dents, xentries=xentries)
+            _, dents, xentries, _ = ubifs._cached_traverse(visitor._inode_dent_xent_collector_visitor)
 
         if output_xentries:
             render_xents(ubifs, xentries)
@@ -774,20 +1022,14 @@ class CommandLine:
         :param args:
         :return:
         """
+
         CommandLine.verbose(args)
 
         include_headers = args.headers
 
-        mtd = self._initialize_mtd(args)
-        mtd.partitions = UBIPartitioner().partition(mtd, fill_partitions=False)
-        ubi = self._initialize_ubi(mtd, args)
-        ubi_vol = self._initialize_ubi_volume(ubi, args)
+        mtd, ubi, ubi_vol = self._open_ubi_volume(args)
 
-        try:
-            sys.stdout.buffer.write(ubi_vol.get_data(include_headers=include_headers))
-        except IOError as e:
-            if e.errno == errno.EPIPE:
-                pass
+        CommandLine._write_stdout(ubi_vol.iter_data(include_headers=include_headers))
 
     def lebcat(self, args) -> None:
         """
@@ -795,37 +1037,28 @@ class CommandLine:
         :param args:
         :return:
         """
+
         CommandLine.verbose(args)
         leb_num = args.lebnumber
         headers = args.headers
 
-        mtd = self._initialize_mtd(args)
-        mtd.partitions = UBIPartitioner().partition(mtd, fill_partitions=False)
-        ubi = self._initialize_ubi(mtd, args)
-        ubi_vol = self._initialize_ubi_volume(ubi, args)
+        mtd, ubi, ubi_vol = self._open_ubi_volume(args)
 
         if leb_num not in ubi_vol.lebs:
             rootlog.error(
                 f"[-] LEB {leb_num} does not exist in UBI Volume {ubi_vol.name}. It might not be mapped to a PEB, this can be validated with 'lebls'.")
             return
         else:
-            try:
-                if headers:
-                    sys.stdout.buffer.write(ubi_vol.lebs[leb_num].peb)
-                else:
-                    sys.stdout.buffer.write(ubi_vol.lebs[leb_num].data)
-            except IOError as e:
-                if e.errno == errno.EPIPE:
-                    pass
+            start, end = ubi_vol.lebs[leb_num].bounds(include_headers=headers)
+            CommandLine._write_stdout([memoryview(mtd.data)[start:end]])
             return
 
     def lebls(self, args):
+        from ubift.cli.renderer import render_lebs
+
         CommandLine.verbose(args)
 
-        mtd = self._initialize_mtd(args)
-        mtd.partitions = UBIPartitioner().partition(mtd, fill_partitions=False)
-        ubi = self._initialize_ubi(mtd, args)
-        ubi_vol = self._initialize_ubi_volume(ubi, args)
+        mtd, ubi, ubi_vol = self._open_ubi_volume(args)
 
         if ubi_vol is not None:
             render_lebs(ubi_vol)
@@ -836,70 +1069,87 @@ class CommandLine:
         CommandLine.verbose(args)
         block_num = args.index
 
-        mtd = self._initialize_mtd(args)
+        mtd = self._open_mtd(args)
 
-        if block_num < 0 or block_num >= len(mtd.data) // mtd.block_size:
-            rootlog.error(f"[-] Invalid physical Erase Block index. Available PEBs for this image are from to 0 to {len(mtd.data) // mtd.block_size - 1}")
+        if block_num < 0 or block_num >= mtd.peb_count:
+            rootlog.error(f"[-] Invalid physical Erase Block index. Available PEBs for this image are from to 0 to {mtd.peb_count - 1}")
         else:
             start = block_num * mtd.block_size
             end = ((block_num + 1) * mtd.block_size)
-            try:
-                sys.stdout.buffer.write(mtd.data[start:end])
-            except IOError as e:
-                if e.errno == errno.EPIPE:
-                    pass
+            CommandLine._write_stdout([memoryview(mtd.data)[start:end]])
 
     def ubils(self, args):
+        from ubift.cli.renderer import render_ubi_instances
+        from ubift.framework.partitioner import UBIPartitioner
+
         CommandLine.verbose(args)
 
-        mtd = self._initialize_mtd(args)
+        mtd = self._open_mtd(args)
         mtd.partitions = UBIPartitioner().partition(mtd, fill_partitions=False)
 
         if args.all:
             for partition in mtd.partitions:
-                ubi = UBI(partition)
+                self._get_ubi(partition)
         else:
             self._initialize_ubi(mtd, args)
 
         render_ubi_instances(mtd)
 
     def fsstat(self, args: argparse.Namespace):
-        CommandLine.verbose(args)
+        from ubift.framework.ubifs import UBIFS
 
-        mtd = self._initialize_mtd(args)
-        mtd.partitions = UBIPartitioner().partition(mtd, fill_partitions=False)
-        ubi = self._initialize_ubi(mtd, args)
-        ubi_vol = self._initialize_ubi_volume(ubi, args)
+        CommandLine.verbose(args)
 
-        ubifs = UBIFS(ubi_vol)
-        sys.stdout.write("Superblock node:\n")
-        for field in ubifs.superblock.__fields__:
-            sys.stdout.write(f"{field}: {getattr(ubifs.superblock, field)}\n")
+        mtd, ubi, ubi_vol = self._open_ubi_volume(args)
 
-        sys.stdout.write(f"\nMaster nodes in LEB1: {len(ubifs.masternodes[0])}, LEB2: {len(ubifs.masternodes[1])}\n")
-        sys.stdout.write("\n(newest) Master node in LEB1:\n")
-        for field in ubifs.masternodes[0][0].__fields__:
-            sys.stdout.write(f"{field}: {getattr(ubifs.masternodes[0][0], field)}\n")
+        # Only the superblock and master nodes are printed, so the index and journal are not parsed
+        ubifs = UBIFS(ubi_vol, parse_index=False)
+        superblock = ubifs.superblock
+        masternode = ubifs.masternodes[0][0]
+        lines = ["Superblock node:\n"]
+        lines += [f"{field}: {getattr(superblock, field)}\n" for field in superblock.__fields__]
+        lines.append(f"\nMaster nodes in LEB1: {len(ubifs.masternodes[0])}, LEB2: {len(ubifs.masternodes[1])}\n")
+        lines.append("\n(newest) Master node in LEB1:\n")
+        lines += [f"{field}: {getattr(masternode, field)}\n" for field in masternode.__fields__]
+        sys.stdout.writelines(lines)
 
     def mtdls(self, args):
+        from ubift.cli.renderer import render_image
+        from ubift.framework.partitioner import UBIPartitioner
+
         CommandLine.verbose(args)
 
-        mtd = self._initialize_mtd(args)
+        mtd = self._open_mtd(args)
         mtd.partitions = UBIPartitioner().partition(mtd, fill_partitions=True)
         render_image(mtd)
 
     def mtdcat(self, args):
+        from ubift.framework.partitioner import UBIPartitioner
+
         CommandLine.verbose(args)
         num = args.index
 
-        mtd = self._initialize_mtd(args)
+        mtd = self._open_mtd(args)
         mtd.partitions = UBIPartitioner().partition(mtd, fill_partitions=True)
 
         if num < 0 or num >= len(mtd.partitions):
             rootlog.error("[-] Invalid Partition index. Use 'mtdls' to see available partitions.")
         else:
-            try:
-                sys.stdout.buffer.write(mtd.partitions[num].data)
-            except IOError as e:
-                if e.errno == errno.EPIPE:
-                    pass
+            partition = mtd.partitions[num]
+            CommandLine._write_stdout([memoryview(mtd.data)[partition.offset:partition.end + 1]])
+
+
+# UBI volumes and their output directories, only set within worker processes of CommandLine.ubift_recover by
+# _init_recover_worker. Workers are forked and get the volumes passed to their initializer without pickling them,
+# so only the index of a volume has to be sent for every job.
+_recover_volumes = []
+
+
+def _init_recover_worker(volumes: List[Tuple[UBIVolume, str]]) -> None:
+    global _recover_volumes
+    _recover_volumes = volumes
+
+
+def _recover_job(index: int, deleted: bool) -> None:
+    ubi_vol, ubi_vol_dir = _recover_volumes[index]
+    CommandLine()._recover_ubi_volume(ubi_vol, ubi_vol_dir, deleted)
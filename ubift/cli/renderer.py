@@ -1,10 +1,10 @@
-import errno
 import logging
 import os
+import shutil
 import sys
 import tempfile
 from datetime import datetime
-from typing import Dict, List
+from typing import Dict, List, BinaryIO
 
 from ubift.framework import ubifs
 from ubift.framework.mtd import Image
@@ -16,6 +16,10 @@ from ubift.framework.ubifs import UBIFS, Journal
 from ubift.framework.util import crc32
 from ubift.logging import ubiftlog
 
+# Buffer size of files that data nodes are written to. Data nodes hold 4KiB at most, so without a larger buffer almost
+# every data node would result in a separate write to the file.
+_DATA_WRITE_BUFFER_SIZE = 1 << 20
+
 
 def readable_size(num: int, suffix="B"):
     """
@@ -77,7 +81,7 @@ def render_recoverability_info(image: Image, ubifs: UBIFS, scanned_inodes: dict,
         if inode.nlink == 0:
             deleted_inodes += 1
             size = inode.ino_size
-            recoverable = min(len(scanned_data_nodes[inum]) * 4096, size) if inum in scanned_data_nodes else 0
+            recoverable = min(len(scanned_data_nodes.get(inum, ())) * 4096, size)
             total_data_len += inode.data_len
             total_size += size
             total_recoverable += recoverable
@@ -193,8 +197,8 @@ def render_inode_list(image: Image, ubifs: UBIFS, inodes: Dict[int, UBIFS_DATA_N
 
 
         if datanodes is not None and dents is not None:
-            datanode_count = 0 if inum not in datanodes else len(datanodes[inum])
-            dentnode_count = 0 if inum not in dents else len(dents[inum])
+            datanode_count = len(datanodes.get(inum, ()))
+            dentnode_count = len(dents.get(inum, ()))
             sys.stdout.write(f"{inum}|{uid}|{gid}|{mtime}|{atime}|{ctime}|{mode}|{nlink}|{size}|{datanode_count}|{dentnode_count}\n")
         else:
             sys.stdout.write(f"{inum}|{uid}|{gid}|{mtime}|{atime}|{ctime}|{mode}|{nlink}|{size}\n")
@@ -334,6 +338,37 @@ def render_lebs(vol: UBIVolume, outfd=sys.stdout):
         outfd.write(f"{zpad(leb.leb_num, 5)}\t--->\t{zpad(leb._peb_num, 5)}\n")
 
 
+def _write_data_nodes(f: BinaryIO, data_nodes: List[UBIFS_DATA_NODE]) -> int:
+    """
+    Writes the decompressed data of data nodes to the positions of their blocks within a (new) file.
+    Data nodes are written in the order of their blocks, so the file is written sequentially and only has to be seeked
+    for holes (seeking flushes the buffer of the file). Only one block of decompressed data is held in memory at a time,
+    it is dropped from its data node once it has been written.
+    The sort is stable, so if there are multiple data nodes for a block, the last one still wins.
+    :param f: File opened for writing, positioned at its start
+    :param data_nodes:
+    :return: Accumulated size of the decompressed data
+    """
+    blocks = sorted(((UBIFS_KEY.from_bytearray(data_node.key).payload, data_node) for data_node in data_nodes),
+                    key=lambda block: block[0])
+
+    accu_size = 0
+    position = 0
+    for block, data_node in blocks:
+        payload = data_node.decompressed_data
+        data_node.decompr_data = None
+
+        offset = 4096 * block
+        if offset != position:
+            f.seek(offset)
+        f.write(payload)
+        position = offset + len(payload)
+
+        accu_size += len(payload)
+
+    return accu_size
+
+
 def write_to_file(inode: UBIFS_INO_NODE, data_nodes: List[UBIFS_DATA_NODE], abs_path: str) -> None:
     """
     Writes data_nodes to a file. Works like 'render_data_nodes' but writes data content to a given path
@@ -353,16 +388,8 @@ def write_to_file(inode: UBIFS_INO_NODE, data_nodes: List[UBIFS_DATA_NODE], abs_
     if counter > 0:
         ubiftlog.warn(f"[!] File {filename} already existed, renamed to: {abs_path}.")
 
-    with open(abs_path, mode="w+b") as f:
-        accu_size = 0  # accumulated size of uncompressed data from data nodes
-        for data_node in data_nodes:
-            data_node_key = UBIFS_KEY.from_bytearray(data_node.key)
-            block = data_node_key.payload
-
-            f.seek(4096 * block)
-            f.write(data_node.decompressed_data)
-
-            accu_size += len(data_node.decompressed_data)
+    with open(abs_path, mode="w+b", buffering=_DATA_WRITE_BUFFER_SIZE) as f:
+        accu_size = _write_data_nodes(f, data_nodes)
 
         if inode.ino_size > accu_size and accu_size > 0:
             ubiftlog.warning(
@@ -378,13 +405,13 @@ def write_to_file(inode: UBIFS_INO_NODE, data_nodes: List[UBIFS_DATA_NODE], abs_
         return
 
 
-def render_data_nodes(ubifs: UBIFS, inode_num: int, data_nodes: List[UBIFS_DATA_NODE], outfd=sys.stdout, inodes: dict = None) -> None:
+def render_data_nodes(ubifs: UBIFS, inode_num: int, data_nodes: List[UBIFS_DATA_NODE], outfd: BinaryIO, inodes: dict = None) -> None:
     """
     Outputs the content of given data nodes. Also does some validation checks, e.g., checks if size of uncompressed
      data matches the size field in the corersponding UBIFS_INO_NODE
     :param inode_num:
     :param data_nodes:
-    :param outfd:
+    :param outfd: Binary stream the data is written to, e.g., sys.stdout.buffer
     :return:
     """
     ubiftlog.info(f"[+] Found {len(data_nodes)} data nodes for inode number {inode_num}.")
@@ -393,16 +420,8 @@ def render_data_nodes(ubifs: UBIFS, inode_num: int, data_nodes: List[UBIFS_DATA_
         ubiftlog.error(f"[-] No data nodes for inode number {inode_num} could be found.")
         return
     else:
-        with tempfile.TemporaryFile(mode="w+b") as temp_file:
-            accu_size = 0  # accumulated size of uncompressed data from data nodes
-            for data_node in data_nodes:
-                data_node_key = UBIFS_KEY.from_bytearray(data_node.key)
-                block = data_node_key.payload
-
-                temp_file.seek(4096 * block)
-                temp_file.write(data_node.decompressed_data)
-
-                accu_size += len(data_node.decompressed_data)
+        with tempfile.TemporaryFile(mode="w+b", buffering=_DATA_WRITE_BUFFER_SIZE) as temp_file:
+            accu_size = _write_data_nodes(temp_file, data_nodes)  # accumulated size of uncompressed data from data nodes
 
             # Fetch inode_node and do some validation checks (compare its 'size' field with accumulated size of uncompressed data)
             inode_node = None
@@ -420,17 +439,12 @@ def render_data_nodes(ubifs: UBIFS, inode_num: int, data_nodes: List[UBIFS_DATA_
                 ubiftlog.error(
                     f"[-] More data has been written ({accu_size}) than what should have written indicated by inode size {inode_node.ino_size}.")
 
-            # Write data to disk or to stdout
+            # Write data to disk or to stdout, copied in chunks so the file is never read into memory as a whole
             temp_file.seek(0)
-            try:
-                outfd.buffer.write(temp_file.read())
-            except IOError as e:
-                if e.errno == errno.EPIPE:
-                    pass
+            shutil.copyfileobj(temp_file, outfd)
             ubiftlog.info(f"[+] Wrote {accu_size} bytes from data nodes for inum {inode_num}")
 
             temp_file.close()
-            outfd.close()
 
             return
 
@@ -478,15 +492,9 @@ def render_xents(ubifs: UBIFS, xents: Dict[int, UBIFS_DENT_NODE], outfd=sys.stdo
         # TODO: This method supports Dict[int, UBIFS_DENT_NODE] and Dict[int, list[UBIFS_DENT_NODE]] therefore this is needed but maybe it can be implemented in a better way
         if isinstance(xent, list):
             for dent2 in xent:
-                outfd.write(f"{dent2.inum}")
-                outfd.write(f"\t\t\t{UBIFS_KEY.from_bytearray(dent2.key).inode_num}\t\t\t")
-                outfd.write(f"{dent2.formatted_name()}")
-                outfd.write("\n")
+                outfd.write(f"{dent2.inum}\t\t\t{UBIFS_KEY.from_bytearray(dent2.key).inode_num}\t\t\t{dent2.formatted_name()}\n")
         else:
-            outfd.write(f"{xent.inum}")
-            outfd.write(f"\t\t\t{UBIFS_KEY.from_bytearray(xent.key).inode_num}\t\t\t")
-            outfd.write(f"{xent.formatted_name()}")
-            outfd.write("\n")
+            outfd.write(f"{xent.inum}\t\t\t{UBIFS_KEY.from_bytearray(xent.key).inode_num}\t\t\t{xent.formatted_name()}\n")
 
 def render_dents(ubifs: UBIFS, dents: Dict[int, UBIFS_DENT_NODE], full_paths: bool, outfd=sys.stdout, deleted:bool = False) -> None:
     """
@@ -500,6 +508,9 @@ def render_dents(ubifs: UBIFS, dents: Dict[int, UBIFS_DENT_NODE], full_paths: bo
     """
     dent_list = dents.values() if isinstance(dents, Dict) else dents
 
+    # Unrolled paths of directories by their inode number, so that every directory is only unrolled once
+    paths = {}
+
     outfd.write("Type\tInode\tParent\tName\n")
     for dent in dent_list:
         # TODO: This method supports Dict[int, UBIFS_DENT_NODE] and Dict[int, list[UBIFS_DENT_NODE]] therefore this is needed but maybe it can be implemented in a better way
@@ -507,25 +518,33 @@ def render_dents(ubifs: UBIFS, dents: Dict[int, UBIFS_DENT_NODE], full_paths: bo
             for dent2 in dent:
                 if deleted and dent2.inum != 0:
                     continue
-                render_inode_type(dent2.type)
-                outfd.write(f"\t{dent2.inum}")
-                outfd.write(f"\t{UBIFS_KEY.from_bytearray(dent2.key).inode_num}\t")
-                if full_paths:
-                    outfd.write(f"{ubifs._unroll_path(dent2, dents)}")
-                else:
-                    outfd.write(f"{dent2.formatted_name()}")
-                outfd.write("\n")
+                name = ubifs._unroll_path(dent2, dents, paths) if full_paths else dent2.formatted_name()
+                outfd.write(f"{inode_type_name(dent2.type)}\t{dent2.inum}\t{UBIFS_KEY.from_bytearray(dent2.key).inode_num}\t{name}\n")
         else:
             if deleted and dent.inum != 0:
                 continue
-            render_inode_type(dent.type)
-            outfd.write(f"\t{dent.inum}")
-            outfd.write(f"\t{UBIFS_KEY.from_bytearray(dent.key).inode_num}\t")
-            if full_paths:
-                outfd.write(f"{ubifs._unroll_path(dent, dents)}")
-            else:
-                outfd.write(f"{dent.formatted_name()}")
-            outfd.write("\n")
+            name = ubifs._unroll_path(dent, dents, paths) if full_paths else dent.formatted_name()
+            outfd.write(f"{inode_type_name(dent.type)}\t{dent.inum}\t{UBIFS_KEY.from_bytearray(dent.key).inode_num}\t{name}\n")
+
+
+_inode_type_names = {
+    UBIFS_INODE_TYPES.UBIFS_ITYPE_REG: "file",
+    UBIFS_INODE_TYPES.UBIFS_ITYPE_DIR: "dir",
+    UBIFS_INODE_TYPES.UBIFS_ITYPE_LNK: "link",
+    UBIFS_INODE_TYPES.UBIFS_ITYPE_BLK: "blk",
+    UBIFS_INODE_TYPES.UBIFS_ITYPE_CHR: "chr",
+    UBIFS_INODE_TYPES.UBIFS_ITYPE_FIFO: "link",
+    UBIFS_INODE_TYPES.UBIFS_ITYPE_SOCK: "sock",
+}
+
+
+def inode_type_name(inode_type: int) -> str:
+    """
+    Returns an UBIFS_INODE_TYPES in a readable format
+    :param inode_type:
+    :return:
+    """
+    return _inode_type_names.get(inode_type, "unkn")
 
 
 def render_inode_type(inode_type: int, outfd=sys.stdout):
@@ -534,22 +553,7 @@ def render_inode_type(inode_type: int, outfd=sys.stdout):
     :param inode_type:
     :return:
     """
-    if inode_type == UBIFS_INODE_TYPES.UBIFS_ITYPE_REG:
-        outfd.write(f"file")
-    elif inode_type == UBIFS_INODE_TYPES.UBIFS_ITYPE_DIR:
-        outfd.write(f"dir")
-    elif inode_type == UBIFS_INODE_TYPES.UBIFS_ITYPE_LNK:
-        outfd.write(f"link")
-    elif inode_type == UBIFS_INODE_TYPES.UBIFS_ITYPE_BLK:
-        outfd.write(f"blk")
-    elif inode_type == UBIFS_INODE_TYPES.UBIFS_ITYPE_CHR:
-        outfd.write(f"chr")
-    elif inode_type == UBIFS_INODE_TYPES.UBIFS_ITYPE_FIFO:
-        outfd.write(f"link")
-    elif inode_type == UBIFS_INODE_TYPES.UBIFS_ITYPE_SOCK:
-        outfd.write(f"sock")
-    else:
-        outfd.write(f"unkn")
+    outfd.write(inode_type_name(inode_type))
 
 
 def render_image(image: Image, outfd=sys.stdout) -> None:
@@ -566,7 +570,7 @@ def render_image(image: Image, outfd=sys.stdout) -> None:
     outfd.write(f"Page Size: {readable_size(image.page_size)}\n")
     outfd.write(f"OOB Size: {readable_size(image.oob_size)}\n\n")
 
-    outfd.write(f"Physical Erase Blocks: {len(image.data) // image.block_size}\n")
+    outfd.write(f"Physical Erase Blocks: {image.peb_count}\n")
     outfd.write(f"Pages per Erase Block: {image.block_size // image.page_size}\n")
     outfd.write("\n")
 
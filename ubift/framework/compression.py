@@ -5,7 +5,9 @@ import zstandard
 import lzo
 
 from ubift import exception
-from ubift.framework.structs.ubifs_structs import UBIFS_COMPRESSION_TYPE
+# ubifs_structs imports this module, so only the module is imported here. Importing names from it would fail if
+# ubifs_structs is imported first, e.g., by ubi.
+from ubift.framework.structs import ubifs_structs
 from ubift.logging import ubiftlog
 
 
@@ -30,6 +32,6 @@ def decompress(data: bytes, compr_type: int, size: int = None) -> bytes:
             raise exception.UBIFTException(f"Data is compressed with unknown type. ({compr_type})")
     except Exception as e:
         ubiftlog.warn(
-            f"[-] Error while decompressing data using {UBIFS_COMPRESSION_TYPE(compr_type).name}: {e}")
+            f"[-] Error while decompressing data using {ubifs_structs.UBIFS_COMPRESSION_TYPE(compr_type).name}: {e}")
         return bytes()
 
@@ -24,6 +24,8 @@ class Image:
         self._block_size = block_size if block_size > 0 else self._guess_block_size(data)
         self._data = data if oob_size <= 0 else Image.strip_oob(data, self.block_size, self.page_size, oob_size)
         self._partitions = []
+        # UBI instances found by the UBIPartitioner per scan threshold, so the Image is only scanned once for them
+        self._ubi_partitions = {}
 
         if len(self._data) % block_size != 0:
             ubiftlog.error(
@@ -48,6 +50,13 @@ class Image:
     def data(self):
         return self._data
 
+    @property
+    def peb_count(self) -> int:
+        """
+        :return: Number of PEBs (without OOB) in the Image
+        """
+        return len(self._data) // self._block_size
+
     @property
     def oob_size(self):
         return self._oob_size
@@ -114,16 +123,11 @@ class Image:
 
         ubiftlog.info(f"[!] Stripping OOB with size {oob_size} from every page.")
 
-        ptr = 0
-        pages = block_size // page_size
-        block_size = block_size + pages * oob_size
-        blocks = len(data) // block_size
-
-        stripped_data = bytearray()
-        for page in range(0, len(data), 2112):
-            stripped_data += data[page:page + page_size]
+        raw_page_size = page_size + oob_size
 
-        return bytes(stripped_data)
+        # Slicing a memoryview does not copy, so every page is only copied once, directly into the joined result
+        view = memoryview(data)
+        return b"".join(view[page:page + page_size] for page in range(0, len(view), raw_page_size))
 
 class Partition:
     """
@@ -4,7 +4,8 @@ from typing import List
 
 from ubift.framework.mtd import Partition, Image
 from ubift.framework.structs.structs import FDT_HEADER
-from ubift.framework.structs.ubi_structs import UBI_EC_HDR, UBI_VID_HDR
+from ubift.framework.structs.ubi_structs import UBI_EC_HDR, UBI_VID_HDR, EC_HDR_VID_HDR_OFFSET, \
+    EC_HDR_VID_HDR_OFFSET_STRUCT, VID_HDR_VOL_ID, VID_HDR_VOL_ID_LNUM_STRUCT
 from ubift.framework.util import find_signature, find_signatures
 
 ubiftlog = logging.getLogger(__name__)
@@ -83,12 +84,15 @@ class UBIPartitioner(Partitioner):
         if hasattr(image, "peb_threshold"):
             self.peb_scan_threshold = image.peb_threshold
 
-        partitions = []
-
-        partition = self._create_partition(image, 0)
-        while partition is not None:
-            partitions.append(partition)
-            partition = self._create_partition(image, partition.end+1)
+        # Scanning the Image for UBI instances only has to be done once, a copy is returned so the cached list stays intact
+        if self.peb_scan_threshold not in image._ubi_partitions:
+            found_partitions = []
+            partition = self._create_partition(image, 0)
+            while partition is not None:
+                found_partitions.append(partition)
+                partition = self._create_partition(image, partition.end+1)
+            image._ubi_partitions[self.peb_scan_threshold] = found_partitions
+        partitions = list(image._ubi_partitions[self.peb_scan_threshold])
 
         if fill_partitions:
             partitions = Partitioner._fill_partitions(image, partitions)
@@ -105,34 +109,38 @@ class UBIPartitioner(Partitioner):
             return None
 
         # TODO: Check the VID_HDR if the leb num maybe already belongs to a new UBI instance
+        data = image.data
+        block_size = image.block_size
+        ec_hdr_magic = UBI_EC_HDR.__magic__
+        vid_hdr_magic = UBI_VID_HDR.__magic__
         volume_lebs = {}
         current = start
         current_gap = 0
-        while image.data[current:current+4] == UBI_EC_HDR.__magic__ or current_gap <= self.peb_scan_threshold:
-            if image.data[current:current+4] != UBI_EC_HDR.__magic__:
+        while data[current:current+4] == ec_hdr_magic or current_gap <= self.peb_scan_threshold:
+            if data[current:current+4] != ec_hdr_magic:
                 current_gap += 1
-                current += image.block_size
+                current += block_size
                 continue
             else:
                 current_gap = 0
             # Check if the lnum in the vid_hdr was already seen (is in the volume_lebs dict),
             #   in which case this might already be another UBI instance
-            ec_hdr = UBI_EC_HDR(image.data, current)
-            vid_hdr = UBI_VID_HDR(image.data, current + ec_hdr.vid_hdr_offset)
-            if vid_hdr.validate_magic():
-                if vid_hdr.vol_id not in volume_lebs:
-                    volume_lebs[vid_hdr.vol_id] = [vid_hdr.lnum]
-                elif vid_hdr.vol_id in volume_lebs:
-                    if vid_hdr.lnum in volume_lebs[vid_hdr.vol_id]:
+            vid_hdr_offset = current + EC_HDR_VID_HDR_OFFSET_STRUCT.unpack_from(data, current + EC_HDR_VID_HDR_OFFSET)[0]
+            if data[vid_hdr_offset:vid_hdr_offset+4] == vid_hdr_magic:
+                vol_id, lnum = VID_HDR_VOL_ID_LNUM_STRUCT.unpack_from(data, vid_hdr_offset + VID_HDR_VOL_ID)
+                if vol_id not in volume_lebs:
+                    volume_lebs[vol_id] = {lnum}
+                elif vol_id in volume_lebs:
+                    if lnum in volume_lebs[vol_id]:
                         # TODO: Check if this works when two UBI instances are placed sequentially in a dump
                         ubiftlog.info(f"[!] Two UBI instances lie sequentially one after the other.")
-                        current -= image.block_size
+                        current -= block_size
                         break
                     else:
-                        volume_lebs[vid_hdr.vol_id].append(vid_hdr.lnum)
+                        volume_lebs[vol_id].add(lnum)
 
-            current += image.block_size
-        current -= image.block_size * current_gap # removes trailing gaps
+            current += block_size
+        current -= block_size * current_gap # removes trailing gaps
         end = current - 1
 
         partition = Partition(image, start, end, UBIPARTITIONER_UBI_DESCRIPTION)
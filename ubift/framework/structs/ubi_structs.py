@@ -1,3 +1,5 @@
+import struct
+
 import cstruct as cstruct
 
 from ubift.framework.structs.structs import MemCStructExt, COMMON_TYPEDEFS
@@ -5,6 +7,14 @@ from ubift.framework.structs.structs import MemCStructExt, COMMON_TYPEDEFS
 # ID of the (internal) Volume that holds the Volume Table
 VTBL_VOLUME_ID = 0x7fffefff
 
+# Offsets and formats of single header fields, for reading them from every PEB without parsing the whole header
+# 'vid_hdr_offset' of an UBI_EC_HDR
+EC_HDR_VID_HDR_OFFSET = 16
+EC_HDR_VID_HDR_OFFSET_STRUCT = struct.Struct(">L")
+# 'vol_id' and 'lnum' of an UBI_VID_HDR
+VID_HDR_VOL_ID = 8
+VID_HDR_VOL_ID_LNUM_STRUCT = struct.Struct(">LL")
+
 class UBI_VID_HDR(MemCStructExt):
     __byte_order__ = cstruct.BIG_ENDIAN
     __magic__ = "\x55\x42\x49\x21".encode("utf-8") # UBI!
@@ -67,10 +77,7 @@ class UBI_VTBL_RECORD(MemCStructExt):
 
     def formatted_name(self) -> str:
         """
-        Prints the name of the Volume by concatenating the hex values and decoding them
+        Prints the name of the Volume by decoding its first name_len bytes
         @return:
         """
-        formatted_name = [f"{x:x}" for x in list(self.name)]
-        formatted_name = formatted_name[:self.name_len]
-        formatted_name = "".join(formatted_name)
-        return bytearray.fromhex(formatted_name).decode(errors="ignore")
+        return bytes(self.name[:self.name_len]).decode(errors="ignore")
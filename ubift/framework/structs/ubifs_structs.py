@@ -91,11 +91,17 @@ class UBIFS_NODE_TYPES(CEnum):
     """
 
 
+# Layout of the first 8 bytes of a key (inode number, key type and payload), compiled once since keys are parsed for
+# almost every node of the B-Tree
+_KEY_STRUCT = struct.Struct("<LL")
+_U16_STRUCT = struct.Struct("<H")
+_U32_STRUCT = struct.Struct("<L")
+
+
 @total_ordering
 class UBIFS_KEY:
     def __init__(self, data: bytes):
-        self.inode_num = struct.unpack("<L", data[:4])[0]
-        value = struct.unpack("<L", data[4:])[0]
+        self.inode_num, value = _KEY_STRUCT.unpack_from(data)
         self.key_type = value >> 29
         self.payload = value & 0x1FFFFFFF
 
@@ -116,9 +122,17 @@ class UBIFS_KEY:
         :param inum: inode number (32bits)
         :param key_type: Type of the key, see 'UBIFS_KEY_TYPES'-Enum for possible types. (3bits)
         :param payload: Payload (last 29bits of key), its meaníng depends on key_type.
-        :return: Returns an instance of UBIFS_KEY
+        :return: Returns an instance of UBIFS_KEY, raises struct.error if a parameter does not fit into its bits
         """
-        return UBIFS_KEY(struct.pack("<LL", inum, (key_type << 29) | payload))
+        # The fields are set directly instead of packing them first and unpacking them again in __init__. Values that
+        # do not fit are rejected (as packing would), instead of silently creating a different key.
+        if not 0 <= inum <= 0xFFFFFFFF or not 0 <= key_type <= 0x7 or not 0 <= payload <= 0x1FFFFFFF:
+            raise struct.error(f"Cannot create UBIFS_KEY (inum: {inum}, key_type: {key_type}, payload: {payload}) because a field is out of range.")
+        key = cls.__new__(cls)
+        key.inode_num = inum
+        key.key_type = int(key_type)
+        key.payload = payload
+        return key
 
     @classmethod
     def from_bytearray(cls, bytes_list: List[int]) -> 'UBIFS_KEY':
@@ -132,8 +146,22 @@ class UBIFS_KEY:
 
         return UBIFS_KEY(bytes(bytes_list[:8]))
 
+    def as_int(self) -> int:
+        """
+        :return: The key as a single integer that is ordered the same way as instances of UBIFS_KEY
+        """
+        return (self.inode_num << 32) | (self.key_type << 29) | self.payload
+
     def pack(self) -> bytes:
-        return struct.pack("<LL", self.inode_num, (self.key_type << 29) | self.payload)
+        return _KEY_STRUCT.pack(self.inode_num, (self.key_type << 29) | self.payload)
+
+    def matches(self, key: List[int]) -> bool:
+        """
+        Compares this key to the raw key of a node without creating an UBIFS_KEY for the latter.
+        :param key: Raw key of a node, e.g., the 'key' field of an UBIFS_INO_NODE
+        :return: True if the first 8 bytes of the raw key encode this key
+        """
+        return bytes(key[:8]) == self.pack()
 
     def __str__(self):
         return f"UBIFS_KEY(inode_num:{self.inode_num}, key_type:{UBIFS_KEY_TYPES(self.key_type)}, payload:{self.payload})"
@@ -265,7 +293,7 @@ class UBIFS_IDX_NODE(MemCStructExt):
         :param args:
         :param kwargs:
         """
-        child_cnt = struct.unpack("<H", data[offset + UBIFS_CH.size:offset + UBIFS_CH.size + 2])[0]
+        child_cnt = _U16_STRUCT.unpack_from(data, offset + UBIFS_CH.size)[0]
         if child_cnt is not None and child_cnt > 0:
             self.set_flexible_array_length(child_cnt)
         super(UBIFS_IDX_NODE, self).__init__(data, offset, *args, **kwargs)
@@ -280,6 +308,23 @@ class UBIFS_IDX_NODE(MemCStructExt):
         };
     """
 
+    def branch_keys(self) -> List[int]:
+        """
+        Returns the keys of all branches as integers (see UBIFS_KEY.as_int), in the same order as the branches.
+        They are computed once per index node, so the branches can be searched with bisect instead of comparing an
+        instance of UBIFS_KEY per branch.
+        :return: List of keys of the branches
+        """
+        keys = self.__dict__.get("_branch_keys")
+        if keys is None:
+            branches = self.branches if isinstance(self.branches, list) else [self.branches]
+            keys = []
+            for branch in branches:
+                inode_num, value = _KEY_STRUCT.unpack_from(bytes(branch.key))
+                keys.append((inode_num << 32) | value)
+            self.__dict__["_branch_keys"] = keys
+        return keys
+
 
 class UBIFS_SB_NODE(MemCStructExt):
     __byte_order__ = LITTLE_ENDIAN
@@ -425,7 +470,7 @@ class UBIFS_INO_NODE(MemCStructExt):
         :param kwargs:
         """
         data_len_offs = offset + UBIFS_CH.size + 16 + (5 * 8) + (8 * 4)
-        data_len = struct.unpack("<I", data[data_len_offs:data_len_offs + 4])[0]
+        data_len = _U32_STRUCT.unpack_from(data, data_len_offs)[0]
         if data_len is not None and data_len > 0:
             self.set_flexible_array_length(data_len)
         super().__init__(data, offset, *args, **kwargs)
@@ -470,7 +515,7 @@ class UBIFS_DENT_NODE(MemCStructExt):
         :param kwargs:
         """
         nlen_offs = offset + UBIFS_CH.size + 16 + 8 + 1 + 1
-        name_len = struct.unpack("<H", data[nlen_offs:nlen_offs + 2])[0]
+        name_len = _U16_STRUCT.unpack_from(data, nlen_offs)[0]
         if name_len is not None and name_len > 0:
             self.set_flexible_array_length(name_len)
         super(UBIFS_DENT_NODE, self).__init__(data, offset, *args, **kwargs)
@@ -491,12 +536,10 @@ class UBIFS_DENT_NODE(MemCStructExt):
 
     def formatted_name(self) -> str:
         """
-        Prints the name of the directory entry by concatenating the hex values and decoding them
+        Prints the name of the directory entry by decoding its bytes
         @return:
         """
-        formatted_name = [f"{x:x}" for x in list(self.name)] # TODO: Apprently this does not work if the last integer is a "0" ? Causes the hex string to miss a trailing 0
-        formatted_name = "".join(formatted_name)
-        return bytearray.fromhex(formatted_name).decode(errors="ignore")
+        return bytes(self.name).decode(errors="ignore")
 
 
 # Maps node_type number to a specific class implementing that node type
@@ -1,13 +1,19 @@
 from __future__ import annotations
 
-from typing import List
+from collections import OrderedDict
+from typing import List, Iterator
 
 from ubift.framework.mtd import Partition
-from ubift.framework.structs.ubi_structs import UBI_VTBL_RECORD, UBI_EC_HDR, VTBL_VOLUME_ID, UBI_VID_HDR
+from ubift.framework.structs.ubi_structs import UBI_VTBL_RECORD, UBI_EC_HDR, VTBL_VOLUME_ID, UBI_VID_HDR, \
+    EC_HDR_VID_HDR_OFFSET, EC_HDR_VID_HDR_OFFSET_STRUCT
 from ubift.framework.structs.ubifs_structs import UBIFS_CH, UBIFS_NODE_TYPES, UBIFS_DENT_NODE
 from ubift.framework.util import find_signature
 from ubift.logging import ubiftlog
 
+# Default amount of LEBs whose data is kept by an UBI instance, see LEB.data. An UBI instance holds at most this many
+# LEBs in memory, i.e., 32 * block_size (4MiB with 128KiB PEBs, 8MiB with 256KiB PEBs) until clear_leb_data is called.
+LEB_DATA_CACHE_SIZE = 32
+
 
 class UBIVolume:
     """
@@ -39,15 +45,19 @@ class UBIVolume:
         :param include_headers: If true, output will contain the UBI headers
         :return: bytes object with contents of the volume's LEBs
         """
-        data = bytes()
-        lebs = list(self.lebs.values())
-        lebs.sort(key=lambda leb: leb.leb_num)
-        for leb in lebs:
-            if include_headers:
-                data += leb.peb
-            else:
-                data += leb.data
-        return data
+        return b"".join(self.iter_data(include_headers=include_headers))
+
+    def iter_data(self, include_headers: bool = False) -> Iterator[memoryview]:
+        """
+        Same as get_data but yields the content LEB by LEB (ordered by LEB number) as views into the image,
+        therefore the content of the whole volume never has to be held in memory.
+        :param include_headers: If true, output will contain the UBI headers
+        :return: memoryview of every LEB
+        """
+        view = memoryview(self.ubi.partition.image.data)
+        for leb_num in sorted(self.lebs):
+            start, end = self.lebs[leb_num].bounds(include_headers=include_headers)
+            yield view[start:end]
 
     def __str__(self):
         return f"UBI Volume '{self.name}' (vol_index: {self._vol_num})" # LEBs: {len(self._lebs)}"
@@ -64,6 +74,12 @@ class UBI:
         self._offset = offset if offset >= 0 else 0
         self._end = end if end >= 0 else (partition.end - partition.offset)
         self._volumes = []
+        # UBIVolumes by their name, see get_volume
+        self._volumes_by_name = {}
+        # Data of the most recently accessed LEBs by their PEB number, see LEB.data. At most leb_data_cache_size LEBs
+        # are kept (0 disables keeping them), shared by all UBIVolumes of this instance.
+        self.leb_data_cache_size = LEB_DATA_CACHE_SIZE
+        self._leb_data = OrderedDict()
 
         if self._validate() == False:
             ubiftlog.warn(
@@ -101,15 +117,18 @@ class UBI:
         :param name: Name of the UBIVolume
         :return: UBIVolume with name or None if there is no such UBIVolume
         """
-        for volume in self.volumes:
-            if volume.name == name:
-                return volume
-        return None
+        return self._volumes_by_name.get(name)
 
     @property
     def partition(self):
         return self._partition
 
+    def clear_leb_data(self) -> None:
+        """
+        Releases the data of LEBs kept by this instance (see LEB.data), e.g., if the instance itself is kept for later use.
+        """
+        self._leb_data.clear()
+
     def _validate(self) -> bool:
         """
         Checks if this is a valid and non-faulty UBI instance by making sure that every PEB has an erase counter header.
@@ -127,7 +146,15 @@ class UBI:
     def _parse_volumes(self) -> None:
         volume_table = {}  # Maps volume_number to a list of LEBS belonging to it
         image = self._partition.image
+        data = image.data
+        start = self._partition.offset + self._offset
+        vid_hdr_magic = UBI_VID_HDR.__magic__
         for peb_num, offset in enumerate(range(0, len(self), image.block_size)):
+            # Usually many PEBs are not mapped (e.g., erased ones), their headers are not parsed only to find that out
+            peb_offset = start + offset
+            vid_hdr_offset = peb_offset + EC_HDR_VID_HDR_OFFSET_STRUCT.unpack_from(data, peb_offset + EC_HDR_VID_HDR_OFFSET)[0]
+            if data[vid_hdr_offset:vid_hdr_offset + 4] != vid_hdr_magic:
+                continue
             leb = LEB(self, peb_num)
             if leb.is_mapped():
                 if leb.vid_hdr.vol_id not in volume_table:
@@ -155,10 +182,12 @@ class UBI:
             if vtbl_record.reserved_pebs > 0:
                 vol = self._create_volume(i, vtbl_record, block_table)
                 self.volumes.append(vol)
+                # Names should be unique, but keep the first volume if they are not (like a linear search would)
+                self._volumes_by_name.setdefault(vol.name, vol)
 
     def _create_volume(self, vol_num: int, vtbl_record: UBI_VTBL_RECORD,
                        block_table: dict[int, List[LEB]]) -> UBIVolume:
-        volume_blocks = block_table[vol_num] if vol_num in block_table else []
+        volume_blocks = block_table.get(vol_num, [])
         vol = UBIVolume(self, vol_num, volume_blocks, vtbl_record)
 
         ubiftlog.info(
@@ -200,24 +229,45 @@ class LEB():
     def is_mapped(self) -> bool:
         return self._vid_hdr.validate_magic() and self._vid_hdr.lnum >= 0
 
+    def bounds(self, include_headers: bool = False) -> tuple[int, int]:
+        """
+        :param include_headers: If true, the bounds will include the UBI headers
+        :return: Start and end offset of the LEB within the image data
+        """
+        image = self._ubi_instance.partition.image
+        start = self._ubi_instance.partition.offset + self._ubi_instance.offset + self._peb_num * image.block_size
+        end = start + image.block_size
+        if not include_headers:
+            start += self.ec_hdr.data_offset
+        return start, end
+
     @property
     def data(self):
         """
+        Slicing the image copies the data of the LEB, but nodes are usually parsed from the same few LEBs one after
+        another (e.g., while traversing the B-Tree). Therefore, the data of the most recently accessed LEBs is kept by
+        the UBI instance, at most 'leb_data_cache_size' LEBs (see LEB_DATA_CACHE_SIZE and UBI.clear_leb_data).
         :return: Returns only the data of the LEB, excluding the headers.
         """
-        image = self._ubi_instance.partition.image
-        data = image.data
-        start = self._ubi_instance.partition.offset + self._ubi_instance.offset + self._peb_num * image.block_size
-        start += self.ec_hdr.data_offset
-        return data[start:start + image.block_size - self.ec_hdr.data_offset]
+        ubi = self._ubi_instance
+        leb_data = ubi._leb_data
+        data = leb_data.get(self._peb_num)
+        if data is not None:
+            leb_data.move_to_end(self._peb_num)
+            return data
+
+        start, end = self.bounds()
+        data = ubi.partition.image.data[start:end]
+        if ubi.leb_data_cache_size > 0:
+            leb_data[self._peb_num] = data
+            if len(leb_data) > ubi.leb_data_cache_size:
+                leb_data.popitem(last=False)
+        return data
 
     @property
     def peb(self):
         """
         :return: Returns the full data of the LEB, including the headers and not only the data.
         """
-        image = self._ubi_instance.partition.image
-        data = image.data
-        start = self._ubi_instance.partition.offset + self._ubi_instance.offset + self._peb_num * image.block_size
-        end = start + image.block_size
-        return data[start:end]
+        start, end = self.bounds(include_headers=True)
+        return self._ubi_instance.partition.image.data[start:end]
@@ -3,6 +3,7 @@ from __future__ import annotations
 import os
 import struct
 import uuid
+from bisect import bisect_left, bisect_right
 from enum import Enum
 from typing import List, Callable, Any
 
@@ -138,18 +139,27 @@ class UBIFS:
     LEB 1 and 2 -> Master node (two identical copies)
     """
 
-    def __init__(self, ubi_volume: UBIVolume, masternode_index: int = -1):
+    def __init__(self, ubi_volume: UBIVolume, masternode_index: int = -1, parse_index: bool = True):
+        """
+        :param ubi_volume: UBI Volume that contains the UBIFS instance
+        :param masternode_index: Index of the master node that will be used, -1 is the most recent one
+        :param parse_index: If False, only the superblock and master nodes are parsed, but not the root index node, orphan nodes and journal
+        """
         self._ubi_volume = ubi_volume
         self.masternode_index = masternode_index
+        self._collected = {}
+        # Parsed index nodes by their LEB number and offset, so that searches within the B-Tree do not parse them again
+        self._idx_nodes = {}
         self.superblock = self._parse_superblock_node()
         self.masternodes = self._parse_master_nodes()
         if len(self.masternodes[0]) - 1 >= self.masternode_index:
             self._used_masternode = self.masternodes[0][self.masternode_index]
-            self._root_idx_node = self._parse_root_idx_node(self._used_masternode)
-            self.orphan_nodes = self._parse_orphan_nodes()
-            ubiftlog.info(
-                f"[!] Using masternode {self.masternode_index} seqnum: {self._used_masternode.ch.sqnum}, log LEB: {self._used_masternode.log_lnum}")
-            self.journal = Journal(self, self._used_masternode.log_lnum)
+            if parse_index:
+                self._root_idx_node = self._parse_root_idx_node(self._used_masternode)
+                self.orphan_nodes = self._parse_orphan_nodes()
+                ubiftlog.info(
+                    f"[!] Using masternode {self.masternode_index} seqnum: {self._used_masternode.ch.sqnum}, log LEB: {self._used_masternode.log_lnum}")
+                self.journal = Journal(self, self._used_masternode.log_lnum)
 
             if not self._validate():
                 raise exception.UBIFTException(f"[-] Invalid UBIFS instance for {self._ubi_volume}")
@@ -265,6 +275,36 @@ class UBIFS:
 
         return root_idx
 
+    def _cached_traverse(self, traversal_function: Callable[[UBIFS_CH, int, int, ...], None]) -> tuple[dict, dict, dict, dict]:
+        """
+        Traverses the whole B-Tree with one of the collecting visitors (see visitor.py) and caches the collected nodes,
+        so that multiple consumers within one command do not walk the B-Tree again.
+        The cache is keyed by the root index node and the visitor, i.e., using another masternode results in a new traversal.
+        :param traversal_function: Visitor that collects nodes into 'inodes', 'dents', 'xentries' or 'datanodes'/'data'
+        :return: Tuple of the collected (inodes, dents, xentries, datanodes), the caller must not modify them
+        """
+        key = (id(self._root_idx_node), traversal_function)
+        if key not in self._collected:
+            inodes, dents, xentries, datanodes = {}, {}, {}, {}
+            self._traverse(self._root_idx_node, traversal_function, inodes=inodes, dents=dents, xentries=xentries,
+                           datanodes=datanodes, data=datanodes)
+            self._collected[key] = (inodes, dents, xentries, datanodes)
+        return self._collected[key]
+
+    def _cached_scan(self, traversal_function: Callable[[UBIFS_CH, int, int, ...], None]) -> tuple[dict, dict, dict, dict]:
+        """
+        Same as "_cached_traverse" but scans all LEBs of the UBI Volume (see _scan_lebs) instead of traversing the B-Tree.
+        :param traversal_function: Visitor that collects nodes into 'inodes', 'dents', 'xentries' or 'datanodes'/'data'
+        :return: Tuple of the collected (inodes, dents, xentries, datanodes), the caller must not modify them
+        """
+        key = (None, traversal_function)
+        if key not in self._collected:
+            inodes, dents, xentries, datanodes = {}, {}, {}, {}
+            self._scan_lebs(traversal_function, inodes=inodes, dents=dents, xentries=xentries, datanodes=datanodes,
+                            data=datanodes)
+            self._collected[key] = (inodes, dents, xentries, datanodes)
+        return self._collected[key]
+
     def _scan_lebs(self, traversal_function: Callable[[UBIFS_CH, int, int, ...], None], **kwargs) -> None:
         """
         Scans the UBI instance for UBIFS_CH signatures. It will only consider LEBs that belong to the UBI Volume of this UBIFS instance.
@@ -299,18 +339,23 @@ class UBIFS:
         :param kwargs:
         :return:
         """
+        # LEB.data slices the image, so it is only fetched once instead of for every found signature
+        data = leb.data
+        leb_num = leb.leb_num
+        magic = "\x31\x18\x10\x06".encode("utf-8")
+
         start_offset = 0
-        stop_offset = len(leb.data) - 1
+        stop_offset = len(data) - 1
 
-        index = find_signature(leb.data, "\x31\x18\x10\x06".encode("utf-8"), start_offset)
+        index = find_signature(data, magic, start_offset)
         while 0 <= index < stop_offset:
             try:
-                ch_hdr = UBIFS_CH(leb.data, index)
-                traversal_function(self, ch_hdr, leb.leb_num, index, **kwargs)
+                ch_hdr = UBIFS_CH(data, index)
+                traversal_function(self, ch_hdr, leb_num, index, **kwargs)
             except Exception as e:
                 ubiftlog.warn(f"[-] Possibly invalid UBIFS_CH at LEB {leb} offset {index} ({e}).")
 
-            index = find_signature(leb.data, "\x31\x18\x10\x06".encode("utf-8"), index + 1)
+            index = find_signature(data, magic, index + 1)
 
     def _scan(self, traversal_function: Callable[[UBIFS_CH, int, int, ...], None], **kwargs) -> None:
         """
@@ -345,13 +390,14 @@ class UBIFS:
 
             index = find_signature(partition.image.data, "\x31\x18\x10\x06".encode("utf-8"), index + 1)
 
-    def _unroll_path(self, dent: UBIFS_DENT_NODE, dents: dict[int, UBIFS_DENT_NODE]) -> str:
+    def _unroll_path(self, dent: UBIFS_DENT_NODE, dents: dict[int, UBIFS_DENT_NODE], paths: dict[int, str] = None) -> str:
         """
         Fetches the complete path of an UBIFS_DENT_NODE up to the root.
         UBIFS_DENT_NODE have 2 inode numbers, one (inside the key[] has the inode number of the parent] and dent.inum is the inode number it is referring to)
         Unroll will fetch the UBIFS_DENT_NODE of the parent recursivly until the dent.inum==1(root-directory) has been reached.
         :param dent: The directory  ntry that will have its path unrolled up to the root
         :param dents: All available directory entry nodes
+        :param paths: Optional cache of already unrolled paths of parent directories by their inode number. If the same dict is passed for all dents, every directory will only be unrolled once.
         :return:
         """
         # The parent-inode of the directory entry is saved in the first 32-Bits of its key
@@ -362,17 +408,21 @@ class UBIFS:
         # Root reached?
         if parent_inum == 1:
             return cur
+        if paths is not None and parent_inum in paths:
+            return os.path.join(paths[parent_inum], cur)
         # Otherwise go up the hierarchy recursivly
-        else:
-            if parent_inum in dents:
-                if isinstance(dents[parent_inum], list):
-                    return os.path.join(self._unroll_path(dents[parent_inum][0], dents), cur)
-                else:
-                   return os.path.join(self._unroll_path(dents[parent_inum], dents), cur)
+        if parent_inum in dents:
+            if isinstance(dents[parent_inum], list):
+                parent_path = self._unroll_path(dents[parent_inum][0], dents, paths)
             else:
-                return cur
+                parent_path = self._unroll_path(dents[parent_inum], dents, paths)
+            if paths is not None:
+                paths[parent_inum] = parent_path
+            return os.path.join(parent_path, cur)
+        else:
+            return cur
 
-    def _find_range(self, node: Any, min_key: UBIFS_KEY, max_key: UBIFS_KEY, _result: List[Any] = []) -> List[Any]:
+    def _find_range(self, node: Any, min_key: UBIFS_KEY, max_key: UBIFS_KEY, _result: List[Any] = None) -> List[Any]:
         """
         Searches for nodes that have a key of min_key <= key < max_key
         :param node:
@@ -388,48 +438,34 @@ class UBIFS:
         if _result is None:
             _result = []
 
+        branch_keys = node.branch_keys()
+        int_min_key = min_key.as_int()
+        int_max_key = max_key.as_int()
+
         # At level 0, select all leafs that are within [min, max)
         if node.level == 0:
             for i, branch in enumerate(node.branches):
-                if min_key <= branch.python_key() < max_key:
+                branch_key = branch_keys[i]
+                # Branches are sorted by their keys, so none of the remaining ones can be within the range
+                if branch_key >= int_max_key:
+                    break
+                if int_min_key <= branch_key:
                     target_node = parse_arbitrary_node(self.ubi_volume.lebs[branch.lnum].data, branch.offs)
                     if target_node is not None:
                         _result.append(target_node)
             return _result
 
-        # Select all branches that are within [min, max)
-        start_index = None
-        end_index = None
-        for i, branch in enumerate(node.branches):
-            branch_key = branch.python_key()
-            if branch_key > min_key and start_index is None:
-                if i == 0:
-                    start_index = 0
-                else:
-                    start_index = i - 1
-            elif branch_key > max_key and end_index is None:
-                if i == len(node.branches) - 1:
-                    end_index = len(node.branches) - 1
-                    if start_index is None:
-                        start_index = end_index
-                    break
-                else:
-                    end_index = i - 1
-                    if start_index is None:
-                        start_index = end_index
-                    break
-            if end_index is None and i == len(node.branches) - 1:
-                end_index = len(node.branches) - 1
-                if start_index is None:
-                    start_index = end_index
-                break
+        # Select all branches that may contain keys within [min, max). The key of a branch is the smallest key of its
+        # subtree, but keys can occur multiple times (e.g., directory entries whose names have the same hash), so the
+        # branch before the first one with a key >= min_key may end with keys equal to min_key.
+        start_index = max(bisect_left(branch_keys, int_min_key) - 1, 0)
+        end_index = max(bisect_left(branch_keys, int_max_key) - 1, start_index)
 
         # Recursivly call this function for all selected branches
         for i in range(start_index, end_index + 1):
-            branch = node.branches[i]
-            target_node = parse_arbitrary_node(self.ubi_volume.lebs[branch.lnum].data, branch.offs)
-            if isinstance(target_node, UBIFS_IDX_NODE):
-                _result += self._find_range(target_node, min_key, max_key, [])
+            target_node = self._create_idx_node(node.branches[i])
+            if target_node is not None:
+                self._find_range(target_node, min_key, max_key, _result)
             else:
                 ubiftlog.error("[-] Encountering non-index node while traversing B-Tree.")
 
@@ -446,27 +482,22 @@ class UBIFS:
         if isinstance(node.branches, UBIFS_BRANCH):
             node.branches = [node.branches]
 
-        sel_branch = None
-        for i, branch in enumerate(node.branches):
-            branch_key = branch.python_key()
-            if key < branch_key:
-                if i == 0:
-                    sel_branch = branch
-                    break
-                else:
-                    sel_branch = node.branches[i - 1]
-                    break
-            elif key == branch_key:
-                if node.level == 0:
-                    return parse_arbitrary_node(self.ubi_volume.lebs[branch.lnum].data, branch.offs)
-                else:
-                    sel_branch = branch
-        # Greater than last branch, so use last branch.
-        if sel_branch is None:
-            sel_branch = node.branches[-1]
-
-        target_node = parse_arbitrary_node(self.ubi_volume.lebs[sel_branch.lnum].data, sel_branch.offs)
-        if isinstance(target_node, UBIFS_IDX_NODE):
+        # Branches are sorted by their keys, so they can be searched with bisect
+        branch_keys = node.branch_keys()
+        int_key = key.as_int()
+
+        if node.level == 0:
+            i = bisect_left(branch_keys, int_key)
+            if i < len(branch_keys) and branch_keys[i] == int_key:
+                branch = node.branches[i]
+                return parse_arbitrary_node(self.ubi_volume.lebs[branch.lnum].data, branch.offs)
+            return None
+
+        # Select the last branch with a key less or equal than the searched one (or the first if there is none)
+        sel_branch = node.branches[max(bisect_right(branch_keys, int_key) - 1, 0)]
+
+        target_node = self._create_idx_node(sel_branch)
+        if target_node is not None:
             return self._find(target_node, key)
 
     def _traverse(self, node: UBIFS_IDX_NODE, traversal_function: Callable[[UBIFS_CH, int, int, ...], None],
@@ -510,6 +541,9 @@ class UBIFS:
         :param branch: Instance of a UBIFS_BRANCH whose target_node will be returned as UBIFS_IDX_NODE if possible
         :return: Instance of UBIFS_IDX_NODE or None if the target_node of the UBIFS_BRANCH is not an index node.
         """
+        position = (branch.lnum, branch.offs)
+        if position in self._idx_nodes:
+            return self._idx_nodes[position]
         if branch.lnum not in self.ubi_volume.lebs:
             ubiftlog.warn(f"[-] Invalid LEB num in an UBIFS_BRANCH. ({branch})")
             return None
@@ -520,6 +554,7 @@ class UBIFS:
             return None
         if target_node.node_type == UBIFS_NODE_TYPES.UBIFS_IDX_NODE:
             target_node = UBIFS_IDX_NODE(self.ubi_volume.lebs[branch.lnum].data, branch.offs)
+            self._idx_nodes[position] = target_node
             return target_node
         else:
             return None
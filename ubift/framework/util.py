@@ -13,13 +13,13 @@ def find_signatures(data: bytes, signature: bytes) -> List[int]:
     :return: Returns all found hits
     """
     all_hits = []
-    ubiftlog.debug(f"[!] Scanning for Signature {signature}")
+    ubiftlog.debug("[!] Scanning for Signature %s", signature)
 
     hit = data.find(signature, 0)
 
     while hit >= 0:
         all_hits.append(hit)
-        ubiftlog.debug(f"[+] Found Signature {signature} at offset {hit}")
+        ubiftlog.debug("[+] Found Signature %s at offset %d", signature, hit)
         hit = data.find(signature, hit + 1)
 
     return all_hits
@@ -34,7 +34,7 @@ def find_signature(data: bytes, signature: bytes, offset: int = 0) -> int:
     """
     hit = data.find(signature, offset)
     if hit >= 0:
-        ubiftlog.debug(f"[+] Found Signature {signature} at offset {hit}")
+        ubiftlog.debug("[+] Found Signature %s at offset %d", signature, hit)
     return hit
 
 
@@ -4,6 +4,18 @@ from ubift.framework.ubifs import UBIFS
 from ubift.logging import ubiftlog
 
 
+def _add_xentry(xentries: dict[int, list[UBIFS_DENT_NODE]], xent_node: UBIFS_DENT_NODE) -> None:
+    """
+    Adds a node of type UBIFS_XENT_NODE to 'xentries', bucketed by the inode the extended attribute belongs to (the
+    inode number of its key).
+    """
+    host_inum = UBIFS_KEY(bytes(xent_node.key[:8])).inode_num
+    if host_inum in xentries:
+        xentries[host_inum].append(xent_node)
+    else:
+        xentries[host_inum] = [xent_node]
+
+
 def _dent_scan_visitor(ubifs: UBIFS, ch_hdr: UBIFS_CH, peb_num: int, peb_offs: int, dents: dict[int, list[UBIFS_DENT_NODE]],
                        **kwargs) -> None:
     if ch_hdr.node_type == UBIFS_NODE_TYPES.UBIFS_DENT_NODE:
@@ -16,9 +28,15 @@ def _dent_scan_visitor(ubifs: UBIFS, ch_hdr: UBIFS_CH, peb_num: int, peb_offs: i
 
 
 def _dent_scan_leb_visitor(ubifs: UBIFS, ch_hdr: UBIFS_CH, leb_num: int, leb_offs: int,
-                           dents: dict[int, list[UBIFS_DENT_NODE]], **kwargs):
+                           dents: dict[int, list[UBIFS_DENT_NODE]], inum: int = None, **kwargs):
+    """
+    Collects all nodes of type UBIFS_DENT_NODE, can be used for _scan_lebs as well as _traverse.
+    :param inum: If set, only dents that refer to this inode number are collected
+    """
     if ch_hdr.node_type == UBIFS_NODE_TYPES.UBIFS_DENT_NODE:
         dent_node = UBIFS_DENT_NODE(ubifs.ubi_volume.lebs[leb_num].data, leb_offs)
+        if inum is not None and dent_node.inum != inum:
+            return
         if dent_node.inum in dents:
             dents[dent_node.inum].append(dent_node)
         else:
@@ -27,11 +45,7 @@ def _dent_scan_leb_visitor(ubifs: UBIFS, ch_hdr: UBIFS_CH, leb_num: int, leb_off
 def _dent_xent_scan_leb_visitor(ubifs: UBIFS, ch_hdr: UBIFS_CH, leb_num: int, leb_offs: int,
                            dents: dict[int, list[UBIFS_DENT_NODE]], xentries: dict[int, list[UBIFS_DENT_NODE]], **kwargs):
     if ch_hdr.node_type == UBIFS_NODE_TYPES.UBIFS_XENT_NODE:
-        xent_node = UBIFS_DENT_NODE(ubifs.ubi_volume.lebs[leb_num].data, leb_offs)
-        if xent_node.inum in xentries:
-            xentries[xent_node.inum].append(xent_node)
-        else:
-            xentries[xent_node.inum] = [xent_node]
+        _add_xentry(xentries, UBIFS_DENT_NODE(ubifs.ubi_volume.lebs[leb_num].data, leb_offs))
     elif ch_hdr.node_type == UBIFS_NODE_TYPES.UBIFS_DENT_NODE:
         dent_node = UBIFS_DENT_NODE(ubifs.ubi_volume.lebs[leb_num].data, leb_offs)
         if dent_node.inum in dents:
@@ -40,23 +54,34 @@ def _dent_xent_scan_leb_visitor(ubifs: UBIFS, ch_hdr: UBIFS_CH, leb_num: int, le
             dents[dent_node.inum] = [dent_node]
 
 def _all_collector_visitor(ubifs: UBIFS, ch_hdr: UBIFS_CH, leb_num: int, leb_offs: int, inodes: dict,
-                                  dents: dict[int, list], datanodes: dict[int, list], **kwargs) -> None:
+                                  dents: dict[int, list], datanodes: dict[int, list], ignored_inodes=None, xentries: dict[int, list] = None,
+                                  **kwargs) -> None:
     """
     Same as "_inode_dent_collector_visitor" but also collects data nodes.
+    :param xentries: Optional dict that xent nodes will be collected into, keyed by the inode number of their host inode
+    :param ignored_inodes: Optional container of inode numbers whose nodes will not be collected, e.g., inodes that are already known from the file-index. Nodes of those inodes are dropped right away instead of being kept until the scan is done.
     """
     if ch_hdr.node_type == UBIFS_NODE_TYPES.UBIFS_DENT_NODE:
         dent_node = UBIFS_DENT_NODE(ubifs.ubi_volume.lebs[leb_num].data, leb_offs)
+        if ignored_inodes is not None and dent_node.inum in ignored_inodes:
+            return
         if dent_node.inum in dents:
             dents[dent_node.inum].append(dent_node)
         else:
             dents[dent_node.inum] = [dent_node]
+    elif ch_hdr.node_type == UBIFS_NODE_TYPES.UBIFS_XENT_NODE and xentries is not None:
+        _add_xentry(xentries, UBIFS_DENT_NODE(ubifs.ubi_volume.lebs[leb_num].data, leb_offs))
     elif ch_hdr.node_type == UBIFS_NODE_TYPES.UBIFS_INO_NODE:
         inode_node = UBIFS_INO_NODE(ubifs.ubi_volume.lebs[leb_num].data, leb_offs)
         key = UBIFS_KEY(bytes(inode_node.key[:8]))
+        if ignored_inodes is not None and key.inode_num in ignored_inodes:
+            return
         inodes[key.inode_num] = inode_node
     elif ch_hdr.node_type == UBIFS_NODE_TYPES.UBIFS_DATA_NODE:
         data_node = UBIFS_DATA_NODE(ubifs.ubi_volume.lebs[leb_num].data, leb_offs)
         key = UBIFS_KEY(bytes(data_node.key[:8]))
+        if ignored_inodes is not None and key.inode_num in ignored_inodes:
+            return
         if key.inode_num in datanodes:
             datanodes[key.inode_num].append(data_node)
         else:
@@ -96,16 +121,12 @@ def _inode_dent_xent_collector_visitor(ubifs: UBIFS, ch_hdr: UBIFS_CH, leb_num:
     :param leb_offs: Will be provided by _traverse-function
     :param inodes: Collected nodes of type UBIFS_INO_NODE
     :param dents: Collected nodes of type UBIFS_DENT_NODE
-    :param dents: Collected nodes of type UBIFS_XENT_NODE
+    :param xentries: Collected nodes of type UBIFS_XENT_NODE, keyed by the inode number of their host inode
     :param kwargs:
     :return:
     """
     if ch_hdr.node_type == UBIFS_NODE_TYPES.UBIFS_XENT_NODE:
-        xent_node = UBIFS_DENT_NODE(ubifs.ubi_volume.lebs[leb_num].data, leb_offs)
-        if xent_node.inum in xentries:
-            xentries[xent_node.inum].append(xent_node)
-        else:
-            xentries[xent_node.inum] = [xent_node]
+        _add_xentry(xentries, UBIFS_DENT_NODE(ubifs.ubi_volume.lebs[leb_num].data, leb_offs))
     elif ch_hdr.node_type == UBIFS_NODE_TYPES.UBIFS_DENT_NODE:
         dent_node = UBIFS_DENT_NODE(ubifs.ubi_volume.lebs[leb_num].data, leb_offs)
         if dent_node.inum in dents: